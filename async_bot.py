@@ -0,0 +1,127 @@
+'''Coroutine counterpart of bot.Bet_bot based on pyTelegramBotAPI's AsyncTeleBot. Needs aiohttp.'''
+
+import asyncio
+import os
+import logging
+import time
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+import util
+from bot import Users, reply_text, read_bet_command, format_league_table, BET_USAGE_TEXT, BET_ACCEPTED_TEXT, \
+	BET_REJECTED_TEXT
+from broadcast import Broadcast, read_retry_after, GLOBAL_RATE, CHAT_RATE, WORKERS, MAX_ATTEMPTS
+from rate_limiter import TokenBucket
+from notifications import NotificationAggregator, WINDOW
+from bets import BetBook
+from database import Database
+from config import ADMIN_CHAT_ID
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+
+class AsyncBet_bot(AsyncTeleBot):
+	def __init__(self, token: str, parse_mode: str = None, bets: BetBook = None, db: Database = None, **kwargs):
+		super().__init__(token, parse_mode=parse_mode, **kwargs)
+		self.users = Users()
+		self.bets = bets
+		self.db = db
+		self.global_limiter = TokenBucket(rate=GLOBAL_RATE, capacity=GLOBAL_RATE)
+		self.chat_limiters = {} # chat id -> TokenBucket
+		self.paused_until = 0 # time.monotonic() till which Telegram asked not to send anything
+		self._send_slots = asyncio.Semaphore(WORKERS)
+		self.aggregator = NotificationAggregator(lambda: list(self.users.chat_ids))
+		self.register_message_handler(self.send_welcome, commands=['start', 'help'])
+		self.register_message_handler(self.place_bet, commands=['bet'])
+		self.register_message_handler(self.send_table, commands=['table'])
+		self.register_message_handler(self.echo_all, func=lambda m: True)
+
+	async def send_welcome(self, message):
+		self.users.add(message.chat.id)
+		await self.reply_to(message, "Howdy, how are you doing?")
+
+	async def place_bet(self, message):
+		'''Takes a bet sent as /bet <match id> <score>, e.g. /bet 123 2-1'''
+		bet = read_bet_command(message.text)
+		if self.bets is None or bet is None:
+			await self.reply_to(message, BET_USAGE_TEXT)
+			return
+		# bets are written to sqlite in a thread so that the event loop isn't blocked
+		accepted = await asyncio.to_thread(self.bets.place_bet, message.chat.id, *bet)
+		await self.reply_to(message, BET_ACCEPTED_TEXT if accepted else BET_REJECTED_TEXT)
+
+	async def send_table(self, message):
+		'''Sends league table kept by db'''
+		if self.db is None:
+			return
+		await self.reply_to(message, format_league_table(self.db.read_league_table()))
+
+	async def echo_all(self, message):
+		await self.reply_to(message, reply_text(message.text))
+
+	async def notify_admin(self, text: str):
+		'''Adds a message to admin chat's next digest'''
+		self._add_notification(text, [ADMIN_CHAT_ID])
+
+	async def notify_user(self, chat_id: int, text: str):
+		'''Adds a message to a user's next digest'''
+		self._add_notification(text, [chat_id])
+
+	async def notify_users(self, text: str):
+		'''Adds a message to every user's next digest'''
+		self._add_notification(text)
+
+	def _add_notification(self, text: str, chat_ids: list = None):
+		if self.aggregator.add(text, chat_ids):
+			asyncio.create_task(self._send_digests())
+
+	async def _send_digests(self):
+		'''Sends digests collected for WINDOW seconds'''
+		await asyncio.sleep(WINDOW)
+		for digest, chat_ids in self.aggregator.collect().items():
+			await self.broadcast(chat_ids, digest)
+
+	async def broadcast(self, chat_ids: list, text: str) -> Broadcast:
+		'''Sends a message to given chats concurrently within Telegram limits. Returns delivery stats'''
+		b = Broadcast(text, len(chat_ids))
+		await asyncio.gather(*(self._send_to_chat(chat_id, b) for chat_id in chat_ids))
+		logger.info(f'{b} finished')
+		return b
+
+	def _chat_limiter(self, chat_id: int) -> TokenBucket:
+		if chat_id not in self.chat_limiters:
+			self.chat_limiters[chat_id] = TokenBucket(rate=CHAT_RATE)
+		return self.chat_limiters[chat_id]
+
+	async def _send_to_chat(self, chat_id: int, b: Broadcast):
+		for attempt in range(1, MAX_ATTEMPTS + 1):
+			# waiting for the chat's turn before taking a send slot so that other chats aren't held up
+			await self._chat_limiter(chat_id).acquire_async()
+			async with self._send_slots:
+				pause = self.paused_until - time.monotonic()
+				if pause > 0:
+					await asyncio.sleep(pause)
+				await self.global_limiter.acquire_async()
+				try:
+					await self.send_message(chat_id, b.text)
+				except Exception as e:
+					retry_after = read_retry_after(e)
+					if retry_after is not None:
+						b._count_throttled()
+						self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+					# Telegram's own refusals like a blocked bot won't change on retry, unlike 429 and network errors
+					if (retry_after is not None or not isinstance(e, ApiTelegramException)) and attempt < MAX_ATTEMPTS:
+						continue
+					logger.error(f'Failed to notify user {chat_id}: {e}')
+					b._count(sent=False)
+					return
+			b._count(sent=True)
+			return
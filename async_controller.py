@@ -0,0 +1,204 @@
+'''Coroutine counterpart of controller.Controller. Stat API client, bot polling and match trackers all run as
+coroutines on one event loop, so tracking many matches and serving many users doesn't take a thread each.
+Run with python main.py asyncio. Needs aiohttp.'''
+
+import asyncio
+import datetime
+import logging
+import os
+import config
+import util
+from async_bot import AsyncBet_bot
+from async_stat_api_handler import AsyncStatAPIHandler
+import live
+from bets import BetBook, BetStorage
+from controller import Controller, STORAGE_BACKEND
+from database import Database
+from leaderboard import Leaderboards
+from stat_api_handler import StatAPIHandler
+from storage import JSONStorage, SQLiteStorage
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+
+class AsyncController:
+	def __init__(self):
+		self.db = Database(storage=SQLiteStorage() if STORAGE_BACKEND == 'sqlite' else JSONStorage())
+		season_id = self.db.storage.load_seasons()[-1]['season_id'] # Read season_id of a season last written into db
+		self.db.read_calendar(season_id)
+		self.bets = BetBook(self.db, BetStorage())
+		self.leaderboards = Leaderboards()
+		self.leaderboards.rebuild(self.bets)
+		self.sah = None # aiohttp session can only be created inside a running event loop
+		self.bot = None
+		self._match_tasks = {} # match id -> task tracking the match
+		self._live_matches = set() # ids of matches polled in play
+
+	async def run(self):
+		'''Runs schedule tracking and bot polling till the process is stopped'''
+		self.sah = AsyncStatAPIHandler()
+		self.bot = AsyncBet_bot(token=config.TELEGRAM_TOKEN, parse_mode=None, bets=self.bets, db=self.db)
+		try:
+			await asyncio.gather(self.track_schedule(), self.bot.polling(non_stop=True, interval=0))
+		finally:
+			await self.sah.close()
+
+	async def update_match_data(self, match_id: int) -> bool:
+		'''Downloads data on a match by given match id and updates it in db.
+		Match events are only downloaded when their hash changed. Returns False if nothing changed since last update
+		'''
+		updated_match_data = await self.sah.fetch_match_data_by_id(match_id, events=False)
+		if not updated_match_data:
+			logger.error(f'Failed to update match as None was given')
+			return False
+
+		updated_matches = await self.prepare_changed_matches([updated_match_data])
+		if not updated_matches:
+			return False
+
+		# db writes are done in a thread so that fsync doesn't block the event loop
+		await asyncio.to_thread(self.db.update_matches_data, updated_matches)
+		return True
+
+	async def update_day_data(self, date: datetime.date) -> list:
+		'''Downloads data on all the matches played at a given date with one fixtures list request and updates it
+		in db. Returns ids of matches that changed
+		'''
+		fixtures = await self.sah.get_season_fixtures(self.db.season_id, date=date)
+		if fixtures is None:
+			logger.error(f'Failed to download {date} matches data')
+			return []
+
+		updated_matches = await self.prepare_changed_matches(fixtures)
+		if updated_matches:
+			await asyncio.to_thread(self.db.update_matches_data, updated_matches)
+		return [m['id'] for m in updated_matches]
+
+	async def prepare_changed_matches(self, fixtures: list) -> list:
+		'''Returns prepared data on given matches that changed since they were stored. Events are only downloaded for
+		matches whose events hash changed
+		'''
+		changed_fixtures = [f for f in fixtures if self.db.is_match_changed(f)]
+		events_changed = [f['id'] for f in changed_fixtures if self.db.is_events_changed(f)]
+		fixtures_with_events = await asyncio.gather(*(self.sah.fetch_match_data_by_id(i, events=True)
+													  for i in events_changed))
+		fixtures_with_events = {f['id']: f for f in fixtures_with_events if f}
+
+		updated_matches = []
+		for f in changed_fixtures:
+			if f['id'] in fixtures_with_events:
+				updated_matches.append(StatAPIHandler.prepare_match_data(fixtures_with_events[f['id']]))
+			elif f['id'] not in events_changed:
+				f = StatAPIHandler.prepare_match_data(f)
+				self.db.copy_match_events(f)
+				updated_matches.append(f)
+		return updated_matches
+
+	def track_match(self, match_id: int):
+		'''Starts a task tracking a match. Tracking a match again restarts its task'''
+		if match_id in self._match_tasks:
+			self._match_tasks[match_id].cancel()
+		self._match_tasks[match_id] = asyncio.create_task(self._track_match(match_id))
+
+	async def _track_match(self, match_id: int):
+		''' Keeps track of a match at match day'''
+		try:
+			match_data = self.db.read_match_data(match_id)
+			match_name = Controller.match_name(match_data)
+			match_start_datetime_obj = self.db.read_match_kickoff(match_id)
+			await self.bot.notify_admin(f'Match {match_name} is scheduled for today at '
+										f'{match_start_datetime_obj.strftime("%H:%M")}')
+
+			while True:
+				await util.sleep_until(match_start_datetime_obj)
+				# Updating match time since API only provides start time at the very last moment
+				await self.update_match_data(match_id)
+				if self.db.read_match_kickoff(match_id) <= util.now():
+					break
+				match_start_datetime_obj = self.db.read_match_kickoff(match_id)
+				logger.info(f'Match {match_id} was postponed to {match_start_datetime_obj}')
+			await self.bot.notify_admin(f'Матч {match_name} начался!')
+
+			# polling the match in play till it gets a final status, notifying users about its goals and cards
+			self._live_matches.add(match_id)
+			try:
+				while True:
+					match_data = self.db.read_match_data(match_id)
+					kickoff = self.db.read_match_kickoff(match_id)
+					state = live.read_poll_state(match_data, kickoff, util.now())
+					if state != live.POLL_CONTINUE:
+						break
+					interval = live.count_poll_interval(match_data, kickoff, util.now(), len(self._live_matches))
+					await util.sleep_until(util.now() + datetime.timedelta(seconds=interval))
+					old_events = self.db.read_match_data(match_id).get('events')
+					if await self.update_match_data(match_id):
+						for e in live.read_new_events(old_events, self.db.read_match_data(match_id).get('events')):
+							await self.bot.notify_users(live.format_event(e, match_name))
+			finally:
+				self._live_matches.discard(match_id)
+
+			if state != live.POLL_FINISHED:
+				notice = live.format_poll_stop(match_name, match_data['status'], state)
+				if state == live.POLL_CUT_OFF:
+					logger.error(f'Match {match_id}: {notice}')
+				else:
+					logger.info(f'Match {match_id}: {notice}')
+				await self.bot.notify_admin(notice)
+				return
+			await self.bot.notify_users(live.format_result(match_name, match_data['score']))
+			# bets are settled in sqlite in a thread so that the event loop isn't blocked
+			for user_id, text in await asyncio.to_thread(Controller.settle_match, self.bets, self.leaderboards,
+														 match_data):
+				await self.bot.notify_user(user_id, text)
+		except asyncio.CancelledError:
+			raise
+		except Exception:
+			logger.exception(f'Failed to track match {match_id}')
+		finally:
+			if self._match_tasks.get(match_id) is asyncio.current_task():
+				del self._match_tasks[match_id]
+
+	async def track_schedule(self):
+		'''Every day at MATCHDAY_STATUS_UPDATE_TIME checks if it's a match day and tracks the day's matches.
+		A failed check is logged and the next one is made next day all the same'''
+		while True:
+			try:
+				today = util.now().date()
+				# Updating today's matches daily so that we dont miss postponed ones
+				await self.update_day_data(today)
+
+				day_matches = self.db.read_matches_by_date(today)
+				if day_matches:
+					logger.info(f'It\'s match day! Today\'s matches: {[m["id"] for m in day_matches]}')
+					for m in day_matches:
+						if live.is_polling_over(m):
+							logger.info(f'Match {m["id"]} is already {m["status"]}, not tracking it')
+							continue
+						self.track_match(m['id'])
+				else:
+					next_match_datetime_obj = self.db.read_next_kickoff(util.now())
+					if next_match_datetime_obj:
+						match_datetime = next_match_datetime_obj.strftime(config.PREFERRED_TIME_FORMAT)
+						today_str = today.strftime(config.PREFERRED_TIME_FORMAT.split()[0])
+						await self.bot.notify_admin(f'Today is {today_str} and it\'s not a match day. '
+													f'Next match day is scheduled for {match_datetime}')
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				# a failed check mustn't end the loop, otherwise no match would be tracked anymore
+				logger.exception('Failed to check match day')
+
+			if self.db.is_season_finished():
+				logger.info(f'Season id {self.db.season_id} is finished')
+				return
+
+			await util.sleep_until(util.next_time_of_day(config.MATCHDAY_STATUS_UPDATE_TIME)) # Wait till next day
@@ -0,0 +1,123 @@
+'''This module handles requests to ElenaSport.io the same way stat_api_handler does, but with coroutines so that one event
+loop can serve requests of all the tracked matches. Needs aiohttp.'''
+
+import asyncio
+import os
+import logging
+import datetime
+from typing import Union
+from urllib.parse import urljoin
+import aiohttp
+import util
+from config import STAT_API_URL
+from stat_api_handler import StatAPIHandler, HEADERS, POOL_SIZE, TIMEOUT, RETRIES, RETRY_STATUSES, RETRY_BACKOFF, \
+	rate_limiter
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+
+class AsyncStatAPIHandler:
+	'''Coroutine counterpart of StatAPIHandler. Shares rate limiter with it so that both fit API plan together.
+	Must be created inside a running event loop and closed with close()'''
+
+	def __init__(self, pool_size: int = POOL_SIZE):
+		self.session = aiohttp.ClientSession(headers=HEADERS,
+											 connector=aiohttp.TCPConnector(limit=pool_size),
+											 timeout=aiohttp.ClientTimeout(sock_connect=TIMEOUT[0],
+																		   sock_read=TIMEOUT[1]))
+
+	async def close(self):
+		await self.session.close()
+
+	async def _get(self, url: str, params: dict = None) -> Union[dict, None]:
+		'''Makes GET request once rate limiter lets it through, retrying on connection errors, 429 and 5xx.
+		Returns response json or None if there is no good response'''
+		for attempt in range(RETRIES + 1):
+			await rate_limiter.acquire_async()
+			try:
+				async with self.session.get(url, params=params) as r:
+					if r.status == 200:
+						try:
+							return await r.json(content_type=None)
+						except ValueError:
+							logger.error(f'Response of {url} is not json: {(await r.text())[:200]}')
+							return None
+					if r.status not in RETRY_STATUSES:
+						# error bodies aren't always json, e.g. of a proxy in front of API, and mustn't be retried
+						logger.error(f'Bad request: {r.status} {(await r.text())[:200]} Arg passed: {url}, {params}')
+						return None
+					retry_after = r.headers.get('Retry-After')
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+				logger.error(f'Request to {url} failed: {e}')
+				retry_after = None
+
+			if attempt < RETRIES:
+				await asyncio.sleep(float(retry_after) if retry_after and retry_after.isdigit()
+									else RETRY_BACKOFF * 2 ** attempt)
+
+		logger.error(f'Request to {url} failed {RETRIES + 1} times')
+		return None
+
+	async def get_match_data_by_id(self, match_id: int, events: bool = True) -> Union[dict, None]:
+		'''Gets info on a match with match_id. Based on API's fixtureById method'''
+		r = await self.fetch_match_data_by_id(match_id, events)
+		if r is None:
+			return None
+		return StatAPIHandler.prepare_match_data(r)
+
+	async def fetch_match_data_by_id(self, match_id: int, events: bool = True) -> Union[dict, None]:
+		'''Gets info on a match with match_id as it is given by API. Events are only requested if events is True'''
+		endpoint = '/v2/fixtures/:id'
+		url = urljoin(STAT_API_URL, endpoint.replace(':id', str(match_id)))
+		r = await self._get(url, params={'events': 'True'} if events else None)
+		if r is None:
+			return None
+		return r['data'][0]
+
+	async def get_season_fixtures(self, season_id: int, round: int = None,
+								  date: datetime.date = None) -> Union[list, None]:
+		'''Returns data on all the matches of a season played in a given round and/or at a given date'''
+		matches = await self.fetch_season_fixtures(season_id)
+		if matches is None:
+			return None
+
+		if round is not None:
+			matches = [m for m in matches if m['round'] == round]
+		if date is not None:
+			matches = [m for m in matches if util.parse_match_date(m['date']).date() == date]
+		return matches
+
+	async def fetch_season_fixtures(self, season_id: int) -> Union[list, None]:
+		'''Returns data on all the matches of a season as it is given by API. Pages after the first one are requested
+		together if the first one tells how many pages there are'''
+		endpoint = '/v2/seasons/:id/fixtures'
+		url = urljoin(STAT_API_URL, endpoint.replace(':id', str(season_id)))
+
+		first_page = await self._get(url, params={'page': '1'})
+		if first_page is None:
+			return None
+		pages = [first_page]
+
+		pages_count = StatAPIHandler._count_pages(first_page['pagination'])
+		if pages_count:
+			pages += await asyncio.gather(*(self._get(url, params={'page': str(p)})
+											for p in range(2, pages_count + 1)))
+			if None in pages:
+				return None
+		else:
+			while pages[-1]['pagination']['hasNextPage']:
+				page = await self._get(url, params={'page': str(len(pages) + 1)})
+				if page is None:
+					return None
+				pages.append(page)
+
+		return [match for page in pages for match in page['data']]
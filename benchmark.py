@@ -0,0 +1,156 @@
+'''This module measures Database hot paths over the stored calendars and over calendars scaled up from them.
+Run python benchmark.py [scale ...] (1 10 100 by default). A scaled calendar holds copies of a stored one as separate
+leagues with their own match and team ids. Every run is appended to Benchmarks/history.jsonl (ignored by git) along
+with the commit it was run at, and timings slower than the previous run by more than REGRESSION_THRESHOLD are
+reported.'''
+
+import os
+import sys
+import json
+import copy
+import shutil
+import subprocess
+import tempfile
+import datetime
+import timeit
+import statistics
+from typing import Callable, Union
+import util
+from database import Database
+from storage import JSONStorage
+
+SCALES = (1, 10, 100) # copies of a stored calendar in a scaled one
+REPEATS = 5 # timings taken of each benchmark, the median is kept
+REGRESSION_THRESHOLD = 0.2 # share a timing may grow by since the previous run before it's reported
+LEAGUE_ID_STEP = 10 ** 7 # added to match and team ids of each copy of a calendar
+HISTORY_PATH = os.path.join('Benchmarks', 'history.jsonl')
+
+
+def scale_calendar(calendar: dict, scale: int) -> dict:
+	'''Returns a calendar holding scale copies of given calendar's matches as separate leagues'''
+	matches = []
+	for league in range(scale):
+		shift = league * LEAGUE_ID_STEP
+		for m in calendar['data']:
+			m = copy.deepcopy(m)
+			m['id'] += shift
+			m['idHome'] += shift
+			m['idAway'] += shift
+			m['idLeague'] += shift
+			for e in m.get('events') or []:
+				e['idFixture'] += shift
+				e['idTeam'] += shift
+			matches.append(m)
+	return dict(calendar, data=matches)
+
+
+def measure(func: Callable, setup: Callable = None, number: int = None) -> float:
+	'''Returns median seconds one call of func takes. setup is called before every timing and isn't measured'''
+	timer = timeit.Timer(func)
+	if number is None:
+		number, _ = timer.autorange()
+	timings = []
+	for _ in range(REPEATS):
+		if setup:
+			setup()
+		timings.append(timer.timeit(number) / number)
+	return statistics.median(timings)
+
+
+def run_benchmarks(season_id: int, scale: int) -> dict:
+	'''Returns {benchmark name: seconds} measured on a calendar of a season scaled by scale.
+	Must be run in a directory holding a copy of Database folder'''
+	calendar = JSONStorage().load_calendar(season_id)
+	if scale > 1:
+		JSONStorage().save_calendar(scale_calendar(calendar, scale), season_id)
+
+	db = Database()
+	results = {'read_calendar': measure(lambda: db.read_calendar(season_id), number=1)}
+	db.read_calendar(season_id)
+
+	finished = [m for m in db.matches if m['status'] == 'finished']
+	updated_match = copy.deepcopy(finished[len(finished) // 2])
+	results['update_match_data'] = measure(lambda: db.update_match_data(updated_match))
+
+	def forget_round_dates():
+		db._round_dates = None
+	results['read_round_dates'] = measure(db.read_round_dates, setup=forget_round_dates, number=1)
+
+	current_round = db.count_max_rounds()
+	team_ids = list(db._matches_by_team)
+	def forget_team_matches():
+		db._team_matches = {}
+	results['read_team_previous_matches'] = measure(
+		lambda: [db.read_team_previous_matches(t, 5, current_round) for t in team_ids],
+		setup=forget_team_matches, number=1) / len(team_ids)
+
+	with_events = [m for m in finished if m.get('events')]
+	if with_events: # older calendars were downloaded without events
+		results['read_match_scorers'] = measure(lambda: [db.read_match_scorers(m) for m in with_events]) \
+										/ len(with_events)
+	return results
+
+
+def read_commit() -> Union[str, None]:
+	'''Returns hash of the checked out commit, None if it can't be told'''
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+							  check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def read_last_run(history_path: str = HISTORY_PATH) -> Union[dict, None]:
+	'''Returns the latest run stored in history'''
+	if not os.path.exists(history_path):
+		return None
+	with open(history_path, 'r', encoding='utf-8') as file:
+		lines = [l for l in file if l.strip()]
+	return json.loads(lines[-1]) if lines else None
+
+
+def find_regressions(results: dict, last_results: dict) -> list:
+	'''Returns (benchmark, previous seconds, seconds) of benchmarks which got slower than REGRESSION_THRESHOLD allows'''
+	return [(name, last_results[name], seconds) for name, seconds in results.items()
+			if name in last_results and seconds > last_results[name] * (1 + REGRESSION_THRESHOLD)]
+
+
+def main(scales: tuple = SCALES):
+	season_ids = [int(f.split('_')[-1].split('.')[0]) for f in os.listdir(JSONStorage.calendar_db_dir)
+				  if f.endswith('.txt')]
+	results = {}
+	repo_dir = os.getcwd()
+	for scale in scales:
+		for season_id in season_ids:
+			# benchmarks write into calendars, so they are run on a fresh copy of Database folder every time
+			work_dir = tempfile.mkdtemp(prefix='betbot benchmark ')
+			shutil.copytree(os.path.join(repo_dir, 'Database', 'Calendars'),
+							os.path.join(work_dir, 'Database', 'Calendars'))
+			os.chdir(work_dir)
+			try:
+				for name, seconds in run_benchmarks(season_id, scale).items():
+					results[f'{name} season {season_id} x{scale}'] = seconds
+			finally:
+				os.chdir(repo_dir)
+				shutil.rmtree(work_dir, ignore_errors=True)
+
+	for name, seconds in results.items():
+		print(f'{name:<60} {seconds * 1000:10.3f} ms')
+
+	last_run = read_last_run()
+	if last_run:
+		regressions = find_regressions(results, last_run['results'])
+		for name, last_seconds, seconds in regressions:
+			print(f'REGRESSION {name}: {last_seconds * 1000:.3f} ms -> {seconds * 1000:.3f} ms '
+				  f'(run {last_run["commit"]} -> {read_commit()})')
+		if not regressions:
+			print(f'No regressions since run at commit {last_run["commit"]}')
+
+	util.insure_dir_exists(os.path.dirname(HISTORY_PATH))
+	with open(HISTORY_PATH, 'a', encoding='utf-8') as file:
+		file.write(json.dumps({'time': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': read_commit(),
+							   'results': results}) + '\n')
+
+
+if __name__ == '__main__':
+	main(tuple(int(a) for a in sys.argv[1:]) or SCALES)
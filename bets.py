@@ -0,0 +1,270 @@
+'''This module keeps users' bets on match scores.
+Bets are compact rows of a SQLite table indexed by match and by user, so settling a match reads only its own bets.
+Bets are scored with NumPy in one pass over the whole match or round when it is installed.'''
+
+import os
+import logging
+import itertools
+import re
+import sqlite3
+import threading
+import time
+from typing import Union
+import util
+from database import Database
+from storage import SQLiteStorage
+
+try:
+	import numpy as np
+except ImportError: # bets are scored one by one without numpy
+	np = None
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+EXACT_SCORE_POINTS = 3 # points for a bet on the exact match score
+GOAL_DIFFERENCE_POINTS = 2 # points for a bet on the right goal difference but not the exact score
+OUTCOME_POINTS = 1 # points for a bet on the right winner or a draw only
+
+SCORE_PATTERN = re.compile(r'^\s*(\d+)\s*[-:]\s*(\d+)\s*$')
+
+
+def parse_score(score: str) -> Union[tuple, None]:
+	'''Returns (home goals, away goals) of a score like "2-1" or "2:1" or None if it isn't a score'''
+	m = SCORE_PATTERN.match(score or '')
+	return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+class Scoring:
+	'''Points given for a bet. A bet gets points of the best rule it matches: exact score, goal difference, outcome'''
+
+	def __init__(self, exact_score: int = EXACT_SCORE_POINTS, goal_difference: int = GOAL_DIFFERENCE_POINTS,
+				 outcome: int = OUTCOME_POINTS):
+		self.exact_score = exact_score
+		self.goal_difference = goal_difference
+		self.outcome = outcome
+
+	def count_points(self, home: int, away: int, actual_home: int, actual_away: int) -> int:
+		'''Returns points a bet on home:away score gets when the match ended actual_home:actual_away'''
+		if (home, away) == (actual_home, actual_away):
+			return self.exact_score
+		if home - away == actual_home - actual_away:
+			return self.goal_difference
+		if (home > away) - (home < away) == (actual_home > actual_away) - (actual_home < actual_away):
+			return self.outcome
+		return 0
+
+	def count_points_array(self, home, away, actual_home, actual_away):
+		'''Same as count_points for numpy arrays of bets'''
+		difference = home - away
+		actual_difference = actual_home - actual_away
+		return np.select([(home == actual_home) & (away == actual_away),
+						  difference == actual_difference,
+						  np.sign(difference) == np.sign(actual_difference)],
+						 [self.exact_score, self.goal_difference, self.outcome], default=0)
+
+
+class Settlement:
+	'''Points of bets on a settled match and how they changed since the match was settled last time'''
+
+	def __init__(self, match_id: int):
+		self.match_id = match_id
+		self.points = {} # user id -> points
+		self.deltas = {} # user id -> points added by this settlement, only users whose points changed
+
+	def __repr__(self):
+		return f'Settlement(match {self.match_id}: {len(self.points)} bets, {len(self.deltas)} changed)'
+
+
+class BetStorage:
+	'''Keeps bets in a SQLite database. A bet is one row keyed by (match id, user id) with a second index by user'''
+
+	def __init__(self, db_path: str = None):
+		self.db_path = db_path or SQLiteStorage.db_path
+		self._local = threading.local() # sqlite connections can't be shared between threads
+		self._create_tables()
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		'''Returns connection of the current thread'''
+		if not hasattr(self._local, 'connection'):
+			util.insure_dir_exists(os.path.dirname(self.db_path))
+			connection = sqlite3.connect(self.db_path, timeout=30)
+			connection.row_factory = sqlite3.Row
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute('PRAGMA synchronous=NORMAL')
+			self._local.connection = connection
+		return self._local.connection
+
+	def _create_tables(self):
+		with self.connection as c:
+			# points stay NULL till the match is settled
+			c.executescript('''
+				CREATE TABLE IF NOT EXISTS bets (
+					match_id INTEGER NOT NULL,
+					user_id INTEGER NOT NULL,
+					home_goals INTEGER NOT NULL,
+					away_goals INTEGER NOT NULL,
+					placed_at INTEGER NOT NULL,
+					points INTEGER,
+					PRIMARY KEY (match_id, user_id)
+				) WITHOUT ROWID;
+				CREATE INDEX IF NOT EXISTS bets_user_match ON bets (user_id, match_id);
+			''')
+
+	def save_bets(self, bets: list):
+		'''Inserts or replaces bets given as (match id, user id, home goals, away goals, placed at) in one transaction'''
+		with self.connection as c:
+			c.executemany('INSERT OR REPLACE INTO bets (match_id, user_id, home_goals, away_goals, placed_at) '
+						  'VALUES (?, ?, ?, ?, ?)', bets)
+
+	def load_match_bets(self, match_id: int) -> list:
+		'''Returns all bets on a match'''
+		return self.connection.execute('SELECT * FROM bets WHERE match_id = ?', (match_id,)).fetchall()
+
+	def load_user_bets(self, user_id: int, match_ids: list = None) -> list:
+		'''Returns bets of a user, only on given matches if match_ids are given'''
+		if match_ids is None:
+			return self.connection.execute('SELECT * FROM bets WHERE user_id = ? ORDER BY match_id',
+										   (user_id,)).fetchall()
+		placeholders = ', '.join('?' * len(match_ids))
+		return self.connection.execute(f'SELECT * FROM bets WHERE user_id = ? AND match_id IN ({placeholders}) '
+									   f'ORDER BY match_id', (user_id, *match_ids)).fetchall()
+
+	def load_bets(self, match_ids: list) -> list:
+		'''Returns bets on given matches as (match id, user id, home goals, away goals, points) ordered by match id.
+		Points of bets that weren't settled yet are -1'''
+		placeholders = ', '.join('?' * len(match_ids))
+		cursor = self.connection.cursor()
+		cursor.row_factory = None # plain tuples are much cheaper to build and to turn into an array than Rows
+		return cursor.execute(f'SELECT match_id, user_id, home_goals, away_goals, COALESCE(points, -1) '
+							  f'FROM bets WHERE match_id IN ({placeholders}) ORDER BY match_id', match_ids).fetchall()
+
+	def load_points_by_user(self, match_ids: list = None) -> dict:
+		'''Returns {user id: points} of settled bets on given matches, of all the bets if match_ids aren't given'''
+		if match_ids is None:
+			rows = self.connection.execute('SELECT user_id, SUM(points) FROM bets WHERE points IS NOT NULL '
+										   'GROUP BY user_id')
+		else:
+			placeholders = ', '.join('?' * len(match_ids))
+			rows = self.connection.execute(f'SELECT user_id, SUM(points) FROM bets WHERE points IS NOT NULL '
+										   f'AND match_id IN ({placeholders}) GROUP BY user_id', match_ids)
+		return {user_id: points for user_id, points in rows}
+
+	def save_points(self, points: list):
+		'''Stores points of bets given as (match id, user id, points) in one transaction'''
+		with self.connection as c:
+			c.executemany('UPDATE bets SET points = ? WHERE match_id = ? AND user_id = ?',
+						  [(p, match_id, user_id) for match_id, user_id, p in points])
+
+
+class BetBook:
+	'''Takes users' bets on matches of a Database till their kickoff and settles them when matches finish'''
+
+	def __init__(self, db: Database, storage: BetStorage = None, scoring: Scoring = None):
+		self.db = db
+		self.storage = storage or BetStorage()
+		self.scoring = scoring or Scoring()
+
+	def is_bet_open(self, match_id: int) -> bool:
+		'''Tells if bets on a match are still taken. Bets are closed at match kickoff'''
+		kickoff = self.db.read_match_kickoff(match_id)
+		return kickoff is not None and util.now() < kickoff
+
+	def place_bet(self, user_id: int, match_id: int, score: str) -> bool:
+		'''Stores a user's bet on a match score like "2-1", replacing the previous one.
+		Returns False if the score can't be read or the match has already started'''
+		return self.place_bets([(user_id, match_id, score)]) == 1
+
+	def place_bets(self, bets: list) -> int:
+		'''Stores bets given as (user id, match id, score) at once. Returns number of bets taken'''
+		placed_at = int(time.time())
+		rows = []
+		for user_id, match_id, score in bets:
+			goals = parse_score(score)
+			if goals is None:
+				logger.error(f'Bet of user {user_id} on match {match_id} is not a score: {score}')
+				continue
+			if not self.is_bet_open(match_id):
+				logger.error(f'Bet of user {user_id} on match {match_id} refused: bets are closed')
+				continue
+			rows.append((match_id, user_id, *goals, placed_at))
+		self.storage.save_bets(rows)
+		return len(rows)
+
+	def read_user_bets(self, user_id: int, match_ids: list = None) -> list:
+		'''Returns bets of a user as dicts, only on given matches if match_ids are given'''
+		return [dict(r) for r in self.storage.load_user_bets(user_id, match_ids)]
+
+	def settle_match(self, match_id: int) -> Union[Settlement, None]:
+		'''Counts points of every bet on a finished match and stores them. Returns None if the match isn't finished'''
+		return self.settle_matches([match_id]).get(match_id)
+
+	def settle_round(self, round: int) -> dict:
+		'''Settles every finished match of a round at once. Returns {match id: Settlement}'''
+		return self.settle_matches([match_id for match_id in self.db.read_match_ids_by_round(round)
+									if self.db.read_match_data(match_id)['status'] == 'finished'])
+
+	def settle_matches(self, match_ids: list) -> dict:
+		'''Counts points of every bet on given finished matches in one pass and stores those that changed.
+		Settling a match again, e.g. after its result was corrected, only changes points that differ.
+		Returns {match id: Settlement}'''
+		results = {}
+		for match_id in match_ids:
+			match_data = self.db.read_match_data(match_id)
+			score = parse_score(match_data['score']) if match_data and match_data['status'] == 'finished' else None
+			if score is None:
+				logger.error(f'Match {match_id} can\'t be settled as it isn\'t finished')
+				continue
+			results[match_id] = score
+		if not results:
+			return {}
+
+		bets = self.storage.load_bets(list(results))
+		settlements = {match_id: Settlement(match_id) for match_id in results}
+		if np is not None and bets:
+			# filling a flat array straight from the rows skips the tuple per bet np.array would inspect
+			bets_array = np.fromiter(itertools.chain.from_iterable(bets), dtype=np.int64, count=len(bets) * 5)
+			changed = self._settle_array(bets_array.reshape(-1, 5), results, settlements)
+		else:
+			changed = []
+			for match_id, user_id, home, away, old_points in bets:
+				settlement = settlements[match_id]
+				points = self.scoring.count_points(home, away, *results[match_id])
+				settlement.points[user_id] = points
+				if points != old_points:
+					settlement.deltas[user_id] = points - max(old_points, 0)
+					changed.append((match_id, user_id, points))
+		self.storage.save_points(changed)
+		logger.info(f'{len(bets)} bets on matches {list(results)} settled, {len(changed)} changed')
+		return settlements
+
+	def _settle_array(self, bets, results: dict, settlements: dict) -> list:
+		'''Fills settlements in from an array of bets as given by BetStorage.load_bets, ordered by match id.
+		Returns (match id, user id, points) of bets whose points changed'''
+		match_ids, user_ids, old_points = bets[:, 0], bets[:, 1], bets[:, 4]
+		settled_ids = np.array(sorted(results), dtype=np.int64)
+		actual = np.array([results[i] for i in settled_ids.tolist()], dtype=np.int64)
+		bet_results = actual[np.searchsorted(settled_ids, match_ids)]
+		points = self.scoring.count_points_array(bets[:, 2], bets[:, 3], bet_results[:, 0], bet_results[:, 1])
+		changed = points != old_points
+		deltas = points - np.maximum(old_points, 0)
+
+		# bets are ordered by match id so every match's bets are one slice
+		starts = np.searchsorted(match_ids, settled_ids, side='left').tolist()
+		ends = np.searchsorted(match_ids, settled_ids, side='right').tolist()
+		for match_id, start, end in zip(settled_ids.tolist(), starts, ends):
+			settlement = settlements[match_id]
+			settlement.points = dict(zip(user_ids[start:end].tolist(), points[start:end].tolist()))
+			match_changed = changed[start:end]
+			settlement.deltas = dict(zip(user_ids[start:end][match_changed].tolist(),
+										 deltas[start:end][match_changed].tolist()))
+		return np.column_stack((match_ids, user_ids, points))[changed].tolist()
@@ -1,19 +1,123 @@
+import os
+import codec
+import logging
+import threading
+from typing import Union
 import telebot
-from config import TELEGRAM_TOKEN
+import util
+from broadcast import Broadcaster
+from notifications import NotificationAggregator, DigestSender
+from bets import BetBook
+from database import Database
+from config import ADMIN_CHAT_ID
 
-bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode=None)
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
 
-@bot.message_handler(commands=['start', 'help'])
-def send_welcome(message):
-	bot.reply_to(message, "Howdy, how are you doing?")
 
-@bot.message_handler(func=lambda m: m.text in ('Привет!', 'Как дела?'))
-def echo_special(message):
-	reply_text = 'Даров!' if message.text == 'Привет!' else 'Да норм. Сам как?'
-	bot.reply_to(message, reply_text)
+class Users:
+	'''Chat ids of users who started the bot, kept in a text file'''
 
-@bot.message_handler(func=lambda m: True)
-def echo_all(message):
-	bot.reply_to(message, message.text)
+	users_db_dir = os.path.join('Database', 'Users')
+	users_db_filename = 'users.txt'
+	users_db_path = os.path.join(users_db_dir, users_db_filename)
 
-#bot.polling(none_stop=True, interval=0)
\ No newline at end of file
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.chat_ids = []
+		if os.path.exists(Users.users_db_path):
+			self.chat_ids = codec.load_file(Users.users_db_path)
+
+	def add(self, chat_id: int) -> bool:
+		'''Adds a chat id and dumps users db. Returns False if chat id is already there'''
+		with self._lock:
+			if chat_id in self.chat_ids:
+				return False
+			self.chat_ids.append(chat_id)
+			util.insure_dir_exists(Users.users_db_dir)
+			codec.dump_file(Users.users_db_path, self.chat_ids)
+		logger.info(f'User {chat_id} added')
+		return True
+
+
+def reply_text(text: str) -> str:
+	'''Returns bot's answer to a text message'''
+	if text in ('Привет!', 'Как дела?'):
+		return 'Даров!' if text == 'Привет!' else 'Да норм. Сам как?'
+	return text
+
+
+BET_USAGE_TEXT = 'Ставка делается так: /bet <id матча> <счёт>, например /bet 123 2-1'
+BET_ACCEPTED_TEXT = 'Ставка принята'
+BET_REJECTED_TEXT = 'Ставка не принята: неверный счёт или матч уже начался'
+
+
+def read_bet_command(text: str) -> Union[tuple, None]:
+	'''Returns (match id, score) from a /bet <match id> <score> command, None if it isn't one'''
+	args = text.split(maxsplit=2)[1:]
+	if len(args) != 2 or not args[0].isdigit():
+		return None
+	return int(args[0]), args[1]
+
+
+def format_league_table(standings: list) -> str:
+	'''Returns league table as text, a line per team'''
+	return '\n'.join(f'{r["position"]}. {r["name"]} {r["played"]} {r["goals_for"]}-{r["goals_against"]} '
+					 f'{r["points"]} {r["form"]}' for r in standings)
+
+
+class Bet_bot(telebot.TeleBot):
+	def __init__(self, token: str, parse_mode: str = None, bets: BetBook = None, db: Database = None, **kwargs):
+		super().__init__(token, parse_mode=parse_mode, **kwargs)
+		self.users = Users()
+		self.bets = bets
+		self.db = db
+		self.broadcaster = Broadcaster(self)
+		# notifications fired together, e.g. by simultaneous matches, reach every chat as one message
+		self.digests = DigestSender(NotificationAggregator(lambda: list(self.users.chat_ids)),
+									self.broadcaster.broadcast)
+		self.register_message_handler(self.send_welcome, commands=['start', 'help'])
+		self.register_message_handler(self.place_bet, commands=['bet'])
+		self.register_message_handler(self.send_table, commands=['table'])
+		self.register_message_handler(self.echo_all, func=lambda m: True)
+
+	def send_welcome(self, message):
+		self.users.add(message.chat.id)
+		self.reply_to(message, "Howdy, how are you doing?")
+
+	def place_bet(self, message):
+		'''Takes a bet sent as /bet <match id> <score>, e.g. /bet 123 2-1'''
+		bet = read_bet_command(message.text)
+		if self.bets is None or bet is None:
+			self.reply_to(message, BET_USAGE_TEXT)
+			return
+		self.reply_to(message, BET_ACCEPTED_TEXT if self.bets.place_bet(message.chat.id, *bet) else BET_REJECTED_TEXT)
+
+	def send_table(self, message):
+		'''Sends league table kept by db'''
+		if self.db is None:
+			return
+		self.reply_to(message, format_league_table(self.db.read_league_table()))
+
+	def echo_all(self, message):
+		self.reply_to(message, reply_text(message.text))
+
+	def notify_admin(self, text: str):
+		'''Adds a message to admin chat's next digest'''
+		self.digests.add(text, [ADMIN_CHAT_ID])
+
+	def notify_user(self, chat_id: int, text: str):
+		'''Adds a message to a user's next digest'''
+		self.digests.add(text, [chat_id])
+
+	def notify_users(self, text: str):
+		'''Adds a message to every user's next digest'''
+		self.digests.add(text)
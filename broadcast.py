@@ -0,0 +1,146 @@
+'''This module sends the same message to many Telegram chats at once without getting the bot throttled.
+Messages are queued per chat and sent by a pool of workers within Telegram's global and per chat limits.'''
+
+import os
+import logging
+import queue
+import threading
+import time
+from typing import Union
+import telebot
+import util
+from rate_limiter import TokenBucket
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+GLOBAL_RATE = 30 # messages per second Telegram lets a bot send to different chats
+CHAT_RATE = 1 # messages per second Telegram lets a bot send to one chat
+WORKERS = 8 # threads sending messages
+MAX_ATTEMPTS = 3 # attempts to send a message before it is counted as failed
+
+
+def read_retry_after(e: Exception) -> Union[int, None]:
+	'''Returns seconds Telegram asked to wait for if e is its 429 error, otherwise None'''
+	if getattr(e, 'error_code', None) != 429:
+		return None
+	result_json = getattr(e, 'result_json', None) or {}
+	return result_json.get('parameters', {}).get('retry_after', 1)
+
+
+class Broadcast:
+	'''Delivery stats of one message sent to many chats'''
+
+	def __init__(self, text: str, chats_count: int):
+		self.text = text
+		self.total = chats_count
+		self.sent = 0
+		self.failed = 0
+		self.throttled = 0 # 429 answers received while sending
+		self.started_at = time.monotonic()
+		self.finished_at = None
+		self._lock = threading.Lock()
+		self._done = threading.Event()
+		if not chats_count:
+			self._finish()
+
+	def _count(self, sent: bool):
+		with self._lock:
+			if sent:
+				self.sent += 1
+			else:
+				self.failed += 1
+			if self.sent + self.failed == self.total:
+				self._finish()
+
+	def _count_throttled(self):
+		with self._lock:
+			self.throttled += 1
+
+	def _finish(self):
+		self.finished_at = time.monotonic()
+		self._done.set()
+
+	def wait(self, timeout: float = None) -> bool:
+		'''Blocks till every message is sent or failed. Returns False on timeout'''
+		return self._done.wait(timeout)
+
+	def __repr__(self):
+		duration = (self.finished_at or time.monotonic()) - self.started_at
+		return (f'Broadcast({self.sent} sent, {self.failed} failed of {self.total}, {self.throttled} throttled, '
+				f'{duration:.1f} s)')
+
+
+class Broadcaster:
+	'''Sends messages of a bot to many chats concurrently respecting GLOBAL_RATE and CHAT_RATE.
+	When Telegram answers 429 all the workers pause for retry_after seconds and the message is queued again'''
+
+	def __init__(self, bot: telebot.TeleBot, workers: int = WORKERS):
+		self.bot = bot
+		self.queue = queue.Queue()
+		self.global_limiter = TokenBucket(rate=GLOBAL_RATE, capacity=GLOBAL_RATE)
+		self.chat_limiters = {} # chat id -> TokenBucket
+		self.paused_until = 0 # time.monotonic() till which Telegram asked not to send anything
+		self._lock = threading.Lock()
+		self.workers = [threading.Thread(target=self._send_messages, name=f'broadcast worker {i}', daemon=True)
+						for i in range(workers)]
+		for w in self.workers:
+			w.start()
+
+	def broadcast(self, chat_ids: list, text: str) -> Broadcast:
+		'''Queues text to be sent to every given chat. Returns stats which are filled in as messages are sent'''
+		b = Broadcast(text, len(chat_ids))
+		for chat_id in chat_ids:
+			self.queue.put((chat_id, b, 1))
+		logger.info(f'Broadcast to {len(chat_ids)} chats queued')
+		return b
+
+	def _chat_limiter(self, chat_id: int) -> TokenBucket:
+		with self._lock:
+			if chat_id not in self.chat_limiters:
+				self.chat_limiters[chat_id] = TokenBucket(rate=CHAT_RATE)
+			return self.chat_limiters[chat_id]
+
+	def _send_messages(self):
+		while True:
+			chat_id, b, attempt = self.queue.get()
+			try:
+				self._send_message(chat_id, b, attempt)
+			finally:
+				self.queue.task_done()
+
+	def _send_message(self, chat_id: int, b: Broadcast, attempt: int):
+		pause = self.paused_until - time.monotonic()
+		if pause > 0:
+			time.sleep(pause)
+		self._chat_limiter(chat_id).acquire()
+		self.global_limiter.acquire()
+
+		try:
+			self.bot.send_message(chat_id, b.text)
+		except Exception as e:
+			retry_after = read_retry_after(e)
+			if retry_after is not None:
+				b._count_throttled()
+				self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+				logger.error(f'Throttled by Telegram for {retry_after} s')
+			# Telegram's own refusals like a blocked bot won't change on retry, unlike 429 and network errors
+			retryable = retry_after is not None or not isinstance(e, telebot.apihelper.ApiTelegramException)
+			if retryable and attempt < MAX_ATTEMPTS:
+				self.queue.put((chat_id, b, attempt + 1))
+				return
+			logger.error(f'Failed to send message to chat {chat_id}: {e}')
+			b._count(sent=False)
+		else:
+			b._count(sent=True)
+
+		if b.finished_at:
+			logger.info(f'{b} finished')
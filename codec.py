@@ -0,0 +1,76 @@
+'''This module reads and writes JSON with the fastest library installed: orjson, msgspec or standard json.
+Files only read by the bot are written compact. Run python codec.py pretty <file> [output file] to get an indented
+copy of one for a human to read.'''
+
+import sys
+import json
+from typing import Union
+import util
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+try:
+	import msgspec
+except ImportError:
+	msgspec = None
+
+PRETTY_INDENT = 4
+
+# every library raises a subclass of ValueError on malformed JSON
+DecodeError = ValueError
+
+if orjson is not None:
+	CODEC = 'orjson'
+elif msgspec is not None:
+	CODEC = 'msgspec'
+else:
+	CODEC = 'json'
+
+
+def loads(data: Union[str, bytes]):
+	'''Returns an object decoded from JSON text or bytes'''
+	if orjson is not None:
+		return orjson.loads(data)
+	if msgspec is not None:
+		return msgspec.json.decode(data.encode() if isinstance(data, str) else data)
+	return json.loads(data)
+
+
+def dumps(obj, pretty: bool = False) -> str:
+	'''Returns JSON text of an object, compact unless pretty is True. Non-ascii characters are kept as they are'''
+	if orjson is not None:
+		# orjson can only indent by 2
+		return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)).decode()
+	if msgspec is not None:
+		text = msgspec.json.encode(obj)
+		return (msgspec.json.format(text, indent=PRETTY_INDENT) if pretty else text).decode()
+	if pretty:
+		return json.dumps(obj, indent=PRETTY_INDENT, ensure_ascii=False)
+	return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_file(path: str):
+	'''Returns an object decoded from a JSON file'''
+	with open(path, 'rb') as file:
+		return loads(file.read())
+
+
+def dump_file(path: str, obj, pretty: bool = False):
+	'''Writes an object into a JSON file atomically'''
+	util.write_file_atomically(path, dumps(obj, pretty))
+
+
+def export_pretty(path: str, output_path: str = None):
+	'''Writes an indented copy of a JSON file next to it or into output_path'''
+	output_path = output_path or f'{path}.pretty.json'
+	dump_file(output_path, load_file(path), pretty=True)
+	return output_path
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 3 or sys.argv[1] != 'pretty':
+		print('Usage: python codec.py pretty <file> [output file]')
+		sys.exit(1)
+	print(f'Written into {export_pretty(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)}')
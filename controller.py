@@ -1,16 +1,21 @@
 import datetime
 import logging
 import os
-import json
 import time
 
 import config
 import util
 from typing import Union
 from bot import Bet_bot
-import threading
+from scheduler import Scheduler
+from webhook import WebhookServer
+import telebot
 from stat_api_handler import StatAPIHandler
 from database import Database
+from bets import BetBook, BetStorage
+from leaderboard import Leaderboards
+import live
+from storage import JSONStorage, SQLiteStorage
 
 
 util.insure_dir_exists('Logs')
@@ -26,6 +31,8 @@ log_file_handler.setFormatter(log_formatter)
 
 # TODO all methods in this file must have type hints -> check for it
 
+STORAGE_BACKEND = 'json' # 'json' keeps calendars in text files, 'sqlite' in Database/betbot.sqlite3 (see storage.py)
+
 
 class Controller:
 	# TODO docstring
@@ -37,26 +44,30 @@ class Controller:
 
 	def __init__(self):
 		self.sah = StatAPIHandler()
-		with open(Controller.seasons_db_path, 'r', encoding='utf-8') as f:
-			season_id = json.load(f)[-1]['season_id'] # Read season_id of a season last written into db
-		self.db = Database(season_id = season_id)
-		self.bot = Bet_bot(token = config.TELEGRAM_TOKEN, parse_mode=None)
-		self.seasons = []
-		self.season = Season()
+		self.db = Database(storage=SQLiteStorage() if STORAGE_BACKEND == 'sqlite' else JSONStorage())
+		self.seasons = self.db.storage.load_seasons()
+		self.season = self.seasons[-1] # season last written into db
+		self.db.read_calendar(self.season['season_id'])
+		self.bets = BetBook(self.db, BetStorage())
+		self.leaderboards = Leaderboards()
+		self.leaderboards.rebuild(self.bets)
+		self.bot = Bet_bot(token = config.TELEGRAM_TOKEN, parse_mode=None, bets=self.bets, db=self.db)
+		self.scheduler = Scheduler()
+		self._live_matches = set() # ids of matches polled in play
 
 	def read_seasons_db(self):
 		'''Reads data stored in database
 		'''
 
-		if not os.path.exists(self.seasons_db_path):
-			logger.error('No file found to read from')
+		seasons = self.db.storage.load_seasons()
+		if not seasons:
+			logger.error('No seasons found to read')
 			return
 
-		with open(Controller.seasons_db_path, 'r', encoding='utf-8') as file:
-			self.seasons = json.load(file)
-			self.season = self.seasons[-1]
-			self.db.read_calendar()
-		logger.info('Seasons file read succesfully')
+		self.seasons = seasons
+		self.season = self.seasons[-1]
+		self.db.read_calendar(self.season['season_id'])
+		logger.info('Seasons db read succesfully')
 
 	def backup_seasons_db(self):
 		'''Dumps self.seasons into a text file as a database
@@ -66,11 +77,8 @@ class Controller:
 			logger.error('Nothing to dump')
 			return
 
-		util.insure_file_exists(Controller.seasons_db_dir, Controller.seasons_db_filename)
-
-		with open(Controller.seasons_db_path, 'w', encoding='utf-8') as file:
-			json.dump(self.seasons, file, indent=4, ensure_ascii=False)
-			logger.info('Seasons db file dumped')
+		self.db.storage.save_seasons(self.seasons)
+		logger.info('Seasons db dumped')
 
 	def create_new_season(self):
 		# TODO docstring
@@ -88,7 +96,7 @@ class Controller:
 		# TODO uncomment and delete debug line
 		#self.season['season_id'] = self.sah.get_current_season_id_by_league_id(self.season['league_id'])
 		self.season['season_id'] = 4208
-		self.db.read_calendar()
+		self.db.read_calendar(self.season['season_id'])
 		self.season['calendar'] = self.db.calendar_name
 		self.season['max_rounds'] = self.db.count_max_rounds()
 		self.season['current_round'] = 1
@@ -126,102 +134,243 @@ class Controller:
 			self.db.update_match_data(match_data)
 			logger.info(f'Match {match_data["id"]} updated')
 
-	def update_match_data(self, match_id: int):
-		'''Downloads data on a match by given match id and updates it in db
+	def update_match_data(self, match_id: int) -> bool:
+		'''Downloads data on a match by given match id and updates it in db.
+		Match events are only downloaded when their hash changed. Returns False if nothing changed since last update
 		'''
 
-		updated_match_data = self.get_match_data(match_id)
+		updated_match_data = self.sah.fetch_match_data_by_id(match_id, events=False)
 		if not updated_match_data:
 			logger.error(f'Failed to update match as None was given')
-			return
+			return False
+
+		if not self.db.is_match_changed(updated_match_data):
+			logger.info(f'Match {match_id} is unchanged')
+			return False
+
+		if self.db.is_events_changed(updated_match_data):
+			updated_match_data = self.sah.fetch_match_data_by_id(match_id, events=True)
+			if not updated_match_data:
+				logger.error(f'Failed to download events of match {match_id}')
+				return False
+			updated_match_data = StatAPIHandler.prepare_match_data(updated_match_data)
+		else:
+			updated_match_data = StatAPIHandler.prepare_match_data(updated_match_data)
+			self.db.copy_match_events(updated_match_data)
 
 		self.update_match_data_in_db(updated_match_data)
 		logger.info(f'Data on match {match_id} downloaded')
+		return True
 
-	def update_round_data(self, round: int):
-		# TODO is this methods used anywhere???
-		# TODO docstring
-		match_ids = self.db.read_match_ids_by_round(round)
-		for mi in match_ids:
-			self.update_match_data(mi)
+	def update_round_data(self, round: int) -> list:
+		'''Downloads data on all the matches of a given round with one fixtures list request and updates it in db.
+		Returns ids of matches that changed
+		'''
+		fixtures = self.sah.get_season_fixtures(self.db.season_id, round=round)
+		if fixtures is None:
+			logger.error(f'Failed to download round {round} data')
+			return []
+
+		changed_match_ids = self.update_fixtures_in_db(fixtures)
 		logger.info(f'Round data {round} updated successfully')
+		return changed_match_ids
+
+	def update_day_data(self, date: datetime.date) -> list:
+		'''Downloads data on all the matches played at a given date with one fixtures list request and updates it
+		in db. Returns ids of matches that changed
+		'''
+		fixtures = self.sah.get_season_fixtures(self.db.season_id, date=date)
+		if fixtures is None:
+			logger.error(f'Failed to download {date} matches data')
+			return []
+
+		changed_match_ids = self.update_fixtures_in_db(fixtures)
+		logger.info(f'{date} matches data updated successfully')
+		return changed_match_ids
+
+	def update_fixtures_in_db(self, fixtures: list) -> list:
+		'''Updates matches from fixtures list in db with one write. Events are only downloaded for matches whose events
+		hash changed. Returns ids of matches that changed
+		'''
+		updated_matches = []
+		for f in fixtures:
+			if not self.db.is_match_changed(f):
+				continue
+
+			if self.db.is_events_changed(f):
+				f = self.sah.fetch_match_data_by_id(f['id'], events=True)
+				if not f:
+					continue
+				f = StatAPIHandler.prepare_match_data(f)
+			else:
+				f = StatAPIHandler.prepare_match_data(f)
+				self.db.copy_match_events(f)
+			updated_matches.append(f)
+
+		if updated_matches:
+			self.db.update_matches_data(updated_matches)
+		return [m['id'] for m in updated_matches]
 
 	def track_match(self, match_id: int):
 		''' Keeps track of a match at match day
-		This func serves as a target for a thread so that we can track simultaneous matches
+		Schedules kickoff notice and result check of a match. Scheduling a match again moves its jobs to its
+		current kickoff time
 		'''
 
-		print(f'Tracking match id {match_id} ...')
-		# Updating match time since API only provides start time at the very last moment
-		self.update_match_data(match_id)
 		match_data = self.db.read_match_data(match_id)
-		match_name = f'{match_data["homeName"]} - {match_data["awayName"]}'
-		match_start_time_str = match_data["date"].split()[1]
-		self.bot.notify_admin(f'Match {match_name} is scheduled for today at {match_start_time_str}')
+		match_start_datetime_obj = self.db.read_match_kickoff(match_id)
+		match_start_time_str = match_start_datetime_obj.strftime('%H:%M')
+		self.bot.notify_admin(f'Match {Controller.match_name(match_data)} is scheduled for today at '
+							  f'{match_start_time_str}')
+
+		self.schedule_match_jobs(match_id)
+
+	def schedule_match_jobs(self, match_id: int):
+		'''Schedules (or reschedules) kickoff notice of a match by its kickoff time'''
+		match_start_datetime_obj = self.db.read_match_kickoff(match_id)
+		self.scheduler.cancel(f'live {match_id}')
+		self.scheduler.schedule(match_start_datetime_obj, self.notify_match_started, match_id,
+								key=f'kickoff {match_id}')
+
+	def notify_match_started(self, match_id: int):
+		'''Notifies admin about match kickoff unless the match was postponed and starts polling it in play'''
+		# Updating match time since API only provides start time at the very last moment
+		if self.update_match_data(match_id) and self.db.read_match_kickoff(match_id) > util.now():
+			logger.info(f'Match {match_id} was postponed to {self.db.read_match_kickoff(match_id)}')
+			self.schedule_match_jobs(match_id)
+			return
 
-		match_start_datetime_obj = match_data["date"].strptime(config.PREFERRED_TIME_FORMAT)
-		util.wait_until(match_start_datetime_obj)
-		self.bot.notify_admin(f'Матч {match_name} начался!')
+		match_data = self.db.read_match_data(match_id)
+		self.bot.notify_admin(f'Матч {Controller.match_name(match_data)} начался!')
+		self._live_matches.add(match_id)
+		self.schedule_live_poll(match_id)
+
+	def schedule_live_poll(self, match_id: int):
+		'''Schedules the next poll of a match in play at an interval depending on the match minute'''
+		now = util.now()
+		interval = live.count_poll_interval(self.db.read_match_data(match_id), self.db.read_match_kickoff(match_id),
+											now, len(self._live_matches))
+		self.scheduler.schedule(now + datetime.timedelta(seconds=interval), self.poll_live_match, match_id,
+								key=f'live {match_id}')
+
+	def poll_live_match(self, match_id: int):
+		'''Downloads data on a match in play and notifies users about its new goals and cards.
+		Polling stops when the match gets a final status or live.LIVE_POLL_CUTOFF after kickoff. A failed poll is
+		followed by the next one all the same'''
+		try:
+			old_events = self.db.read_match_data(match_id).get('events')
+			if self.update_match_data(match_id):
+				match_data = self.db.read_match_data(match_id)
+				for e in live.read_new_events(old_events, match_data.get('events')):
+					self.bot.notify_users(live.format_event(e, Controller.match_name(match_data)))
+		finally:
+			self.continue_live_poll(match_id)
+
+	def continue_live_poll(self, match_id: int):
+		'''Settles a polled match if it's finished, stops polling it if it won't be played on today or is past
+		cutoff, otherwise schedules its next poll'''
+		match_data = self.db.read_match_data(match_id)
+		state = live.read_poll_state(match_data, self.db.read_match_kickoff(match_id), util.now())
+		if state == live.POLL_CONTINUE:
+			self.schedule_live_poll(match_id)
+			return
 
-		match_finish_datetime_obj = match_start_datetime_obj + datetime.timedelta(minutes=config.MATCH_DURATION)
-		util.wait_until(match_finish_datetime_obj)
+		self._live_matches.discard(match_id)
+		if state == live.POLL_FINISHED:
+			self.finish_match(match_id)
+			return
+		notice = live.format_poll_stop(Controller.match_name(match_data), match_data['status'], state)
+		if state == live.POLL_CUT_OFF:
+			logger.error(f'Match {match_id}: {notice}')
+		else:
+			logger.info(f'Match {match_id}: {notice}')
+		self.bot.notify_admin(notice)
 
-		# getting match results
-		self.update_match_data(match_id)
+	def finish_match(self, match_id: int):
+		'''Notifies users about a finished match result, settles bets on it and updates leaderboards'''
 		match_data = self.db.read_match_data(match_id)
-		match_score = match_data['score']
-		self.bot.notify_users(f'Матч {match_name} завершился!\n'
-							  f'Счёт {match_score}')
+		self.bot.notify_users(live.format_result(Controller.match_name(match_data), match_data['score']))
+
+		for user_id, text in Controller.settle_match(self.bets, self.leaderboards, match_data):
+			self.bot.notify_user(user_id, text)
+
+		# TODO If its last match of the round we must also notify all users about round results
+		# TODO backup seasons db
+
+	@staticmethod
+	def settle_match(bets: BetBook, leaderboards: Leaderboards, match_data: dict) -> list:
+		'''Settles bets on a finished match and updates leaderboards. Returns (user id, text) notifications about
+		points users got or lost by this settlement and their moves in season leaderboard'''
+		settlement = bets.settle_match(match_data['id'])
+		if not settlement:
+			return []
+		# only bets whose points changed are noticed so that settling a match again doesn't repeat the notices
+		notifications = [(user_id, f'Ваша ставка на матч {Controller.match_name(match_data)}: '
+								   f'{settlement.points[user_id]} очк.')
+						 for user_id in settlement.deltas]
+
+		moves = leaderboards.apply(settlement, match_data['round'])
+		for user_id, old_rank, new_rank in moves['season']:
+			direction = 'поднялись' if old_rank is None or new_rank < old_rank else 'опустились'
+			notifications.append((user_id, f'Вы {direction} на {new_rank} место в таблице сезона'))
+		return notifications
 
 	def track_schedule(self):
-		# TODO docstring
-
-		#self.bot.notify_admin(f'{datetime.datetime.now().strftime(config.PREFERRED_TIME_FORMAT)}: exec_schedule in process ...')
-		while True:
-			print(f'Start time: {datetime.datetime.now().strftime("%H:%M:%S")}')
-			# TODO update schedule daily so that we dont miss postponed matches
-			if self.db.today_is_match_day():
-				print(f'It\'s match day! Today\'s matches: {self.db.next_day_matches}')
-				#util.wait_until(config.MATCHDAY_STATUS_UPDATE_TIME) # Uncomment once this method is gebugged
-				now = datetime.datetime.now() # test purpose. Delete
-				match_update_time = now + datetime.timedelta(seconds=3) # test purpose. Delete
-				print(f'Update start time: {match_update_time.strftime("%H:%M:%S")}')
-				print(f'Time to wait until: {match_update_time.strftime("%H:%M")}')
-				util.wait_until(match_update_time)
-				print(f'Day update time: {datetime.datetime.now().strftime("%H:%M:%S")}')
-
-				for match in self.db.next_day_matches:
-					print(self.db.next_day_matches)
-					match_id = list(match.keys())[0]
-					print(f'Match id: {match_id}')
-					threading.Thread(target=self.track_match, args=[match_id]).start()
-
-				# Updating property so that it knows about match_data updates we did in a previous for loop
-				self.next_day_matches = self.db.read_next_day_matches()
-
-				self.db.read_season_status()
-				if self.db.season_status == 'finished': # Check for condition to break while loop
-					break
-
-
-				# TODO count bets results
-				# TODO send users notifications about bet results
-				# TODO update leaderboard
-				# TODO send users notifications about leaderboard changes
-				# TODO If its last match of the round we must also notify all users about round results
-				# TODO add postponed matches
-				# TODO backup seasons db
+		'''Starts tracking season schedule. Every day at MATCHDAY_STATUS_UPDATE_TIME it is checked if it's a match day
+		and the day's matches are scheduled to be tracked. Doesn't block: all the jobs are run by self.scheduler
+		'''
 
+		self.scheduler.start()
+		self.scheduler.schedule(util.now(), self.check_match_day, key='match day check')
+
+	def check_match_day(self):
+		'''Tracks today's matches if it's a match day and schedules the next check for tomorrow.
+		The next check is scheduled even if this one failed, e.g. on a bad API answer, so daily checks never stop'''
+		try:
+			today = util.now().date()
+			# Updating today's matches daily so that we dont miss postponed ones
+			self.update_day_data(today)
+
+			day_matches = self.db.read_matches_by_date(today)
+			if day_matches:
+				logger.info(f'It\'s match day! Today\'s matches: {[m["id"] for m in day_matches]}')
+				for m in day_matches:
+					# a restart mustn't announce and settle matches of the day that are already over once again
+					if live.is_polling_over(m):
+						logger.info(f'Match {m["id"]} is already {m["status"]}, not tracking it')
+						continue
+					self.track_match(m['id'])
 			else:
-				print('NOT MATCH DAY')
-				next_match_datetime_obj = list(self.db.next_day_matches[0].values())[0]
-				match_datetime = next_match_datetime_obj.strftime(config.PREFERRED_TIME_FORMAT)
-				self.bot.notify_admin(f'Today is {datetime.datetime.today().strftime(config.PREFERRED_TIME_FORMAT)}'
-									  f' and it\'s not a match day. Next match day is scheduled for {match_datetime}')
-
-			util.wait_until(config.MATCHDAY_STATUS_UPDATE_TIME) # Wait till next day
+				next_match_datetime_obj = self.db.read_next_kickoff(util.now())
+				if next_match_datetime_obj:
+					match_datetime = next_match_datetime_obj.strftime(config.PREFERRED_TIME_FORMAT)
+					self.bot.notify_admin(f'Today is {today.strftime(config.PREFERRED_TIME_FORMAT.split()[0])}'
+										  f' and it\'s not a match day. Next match day is scheduled for {match_datetime}')
+		finally:
+			if self.db.is_season_finished():
+				#TODO what to do when championship is over
+				logger.info(f'Season id {self.db.season_id} is finished')
+			else:
+				self.scheduler.schedule(util.next_time_of_day(config.MATCHDAY_STATUS_UPDATE_TIME),
+										self.check_match_day, key='match day check') # Wait till next day
+
+	def serve_webhook(self):
+		'''Receives bot updates through a webhook at config.WEBHOOK_URL. Falls back to polling if Telegram refuses the
+		webhook'''
+		webhook_server = WebhookServer(self.bot, config.WEBHOOK_URL)
+		try:
+			webhook_server.start()
+		except telebot.apihelper.ApiException as e:
+			logger.error(f'Failed to set webhook, falling back to polling: {e}')
+			webhook_server.shutdown()
+			self.bot.remove_webhook()
+			self.bot.polling(none_stop=True, interval=0)
+			return
+		webhook_server.serve_forever()
 
-		#TODO what to do when championship is over
+	@staticmethod
+	def match_name(match_data: dict) -> str:
+		return f'{match_data["homeName"]} - {match_data["awayName"]}'
 
 class Season:
 	''' Contains all the info about current season
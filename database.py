@@ -1,12 +1,14 @@
 import os
 import logging
-import json
 import time
+import threading
 from typing import Union
 import util
 import datetime
 from config import PREFERRED_TIME_FORMAT
-from stat_api_handler import StatAPIHandler
+from storage import JSONStorage, SQLiteStorage
+from league_table import LeagueTable
+from team_matches import TeamMatches
 
 util.insure_dir_exists('Logs')
 log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
@@ -19,27 +21,93 @@ log_file_handler = logging.FileHandler(log_file)
 logger.addHandler(log_file_handler)
 log_file_handler.setFormatter(log_formatter)
 
+# Fields of match data given by API which tell whether anything about a match changed since it was stored
+MATCH_CHANGE_FIELDS = ('status', 'round', 'elapsed', 'elapsedPlus', 'eventsHash', 'lineupsHash', 'statsHash',
+					   'team_home_90min_goals', 'team_away_90min_goals', 'team_home_ET_goals', 'team_away_ET_goals',
+					   'team_home_PEN_goals', 'team_away_PEN_goals')
+
 class Database:
-	calendar_db_dir = os.path.join('Database','Calendars')
-	def __init__(self):
+	def __init__(self, storage: Union[JSONStorage, SQLiteStorage] = None):
+		self.storage = storage or JSONStorage()
 		self.content = {}
 		self.matches = []
 		self.calendar_name = ''
+		self.season_id = None
+		self._lock = threading.RLock() # match trackers update db from their own threads
+		# Indexes over self.matches built by _build_indexes so that lookups don't scan the whole calendar
+		self._match_positions = {} # match id -> position of the match in self.matches
+		self._matches_by_round = {} # round -> list of matches
+		self._matches_by_team = {} # team id -> list of matches in calendar order
+		self._matches_by_date = {} # kickoff date -> list of matches
+		self._kickoffs = {} # match id -> timezone aware kickoff datetime parsed once when the match was read
+		self._round_dates = None # cached result of read_round_dates
+		self.table = LeagueTable() # kept up to date by every stored match
+		self._team_matches = {} # team id -> TeamMatches built on demand and dropped when a match of the team changes
 
 	def read_calendar(self, season_id: int) -> Union[dict, None]:
-		'''Reads file and puts it into self.content'''
-
-		db_filename = f'calendar season id_{season_id}.txt'
-		db_path = os.path.join(Database.calendar_db_dir, db_filename)
-		self.calendar_name = db_path
-
-		if db_filename not in db_path:
-			logger.error('Database doesn\'t exist in provided path')
-			return None
+		'''Reads calendar of a given season from storage and puts it into self.content'''
+		with self._lock:
+			content = self.storage.load_calendar(season_id)
+			if content is None:
+				return None
 
-		with open(db_path, 'r', encoding='utf-8') as f:
-			self.content = json.load(f)
+			self.content = content
 			self.matches = self.content['data']
+			self.season_id = season_id
+			self.calendar_name = self.storage.calendar_name
+			self._build_indexes()
+		return self.content
+
+	def _build_indexes(self):
+		'''Builds match id, round, team id and date indexes over self.matches'''
+		self._match_positions = {}
+		self._matches_by_round = {}
+		self._matches_by_team = {}
+		self._matches_by_date = {}
+		self._kickoffs = {}
+		self._round_dates = None
+		self._team_matches = {}
+
+		for i, m in enumerate(self.matches):
+			self._match_positions[m['id']] = i
+			self._matches_by_round.setdefault(m['round'], []).append(m)
+			self._matches_by_team.setdefault(m['idHome'], []).append(m)
+			self._matches_by_team.setdefault(m['idAway'], []).append(m)
+			self._matches_by_date.setdefault(self._read_kickoff(m).date(), []).append(m)
+		self.table.rebuild(self.matches, self._kickoffs)
+
+	def _read_kickoff(self, match_data: dict) -> datetime.datetime:
+		'''Parses kickoff of a match, remembers it in self._kickoffs and returns it.
+		Calendars downloaded before matches got their timestamp are given one here'''
+		if 'timestamp' in match_data:
+			kickoff = util.kickoff_from_timestamp(match_data['timestamp'])
+		else:
+			kickoff = util.parse_match_date(match_data['date'])
+			match_data['timestamp'] = int(kickoff.timestamp())
+		self._kickoffs[match_data['id']] = kickoff
+		return kickoff
+
+	def _reindex_match(self, old_match: dict, new_match: dict):
+		'''Replaces old_match with new_match in every index'''
+		old_kickoff = self._kickoffs[old_match['id']]
+		new_kickoff = self._read_kickoff(new_match)
+		for index, old_key, new_key in ((self._matches_by_round, old_match['round'], new_match['round']),
+										(self._matches_by_team, old_match['idHome'], new_match['idHome']),
+										(self._matches_by_team, old_match['idAway'], new_match['idAway']),
+										(self._matches_by_date, old_kickoff.date(), new_kickoff.date())):
+			bucket = index[old_key]
+			position = next(i for i, m in enumerate(bucket) if m is old_match)
+			if old_key == new_key:
+				bucket[position] = new_match
+				continue
+
+			del bucket[position]
+			if not bucket:
+				del index[old_key]
+			# keeping buckets in calendar order after a match moved to another round or date
+			new_bucket = index.setdefault(new_key, [])
+			new_bucket.append(new_match)
+			new_bucket.sort(key=lambda m: self._match_positions[m['id']])
 
 	def count_max_rounds(self) -> int:
 		'''Returns max rounds in a competition'''
@@ -47,28 +115,30 @@ class Database:
 
 	def read_season_start_date(self) -> str:
 		'''Returns season start date read from a calendar'''
-		return self.matches[0]['date']
+		return self._kickoffs[self.matches[0]['id']].strftime(PREFERRED_TIME_FORMAT)
 
 	def read_season_finish_date(self) -> str:
 		'''Returns season finish date read from a calendar'''
-		return self.matches[-1]['date']
+		return self._kickoffs[self.matches[-1]['id']].strftime(PREFERRED_TIME_FORMAT)
 
 	def read_round_dates(self) -> dict:
 		'''Returns all rounds first and last match dates'''
-		#TODO need to collect all starts as well not only finish dates
-		first_match = self.matches[0]
-		round_dates = {first_match['round']: [first_match['date'], first_match['date']]}
-
-		for m in self.matches:
-			if m['round'] > max(round_dates):
-				round_dates[m['round']] = [m['date'],m['date']]
-				continue
-			curr_match_date = StatAPIHandler.format_time(m['date'])
-			curr_round_date = StatAPIHandler.format_time(round_dates[max(round_dates)][0])
-			if curr_match_date > curr_round_date:
-				round_dates[m['round']][1] = m['date']
-
-		return round_dates
+		if self._round_dates is None:
+			round_kickoffs = {}
+			for m in self.matches:
+				kickoff = self._kickoffs[m['id']]
+				first_and_last = round_kickoffs.get(m['round'])
+				if first_and_last is None:
+					round_kickoffs[m['round']] = [kickoff, kickoff]
+				elif kickoff < first_and_last[0]:
+					first_and_last[0] = kickoff
+				elif kickoff > first_and_last[1]:
+					first_and_last[1] = kickoff
+
+			self._round_dates = {r: [d.strftime(PREFERRED_TIME_FORMAT) for d in first_and_last]
+								 for r, first_and_last in sorted(round_kickoffs.items())}
+
+		return {r: list(dates) for r, dates in self._round_dates.items()}
 
 	def update_match_data(self, match_data: dict):
 		'''Updates calendar file by given match data'''
@@ -76,52 +146,113 @@ class Database:
 			logger.error('None as an argument')
 			return
 
-		for m in self.matches:
-			if m['id'] == match_data['id']:
-				match_index = self.matches.index(m)
-				self.matches[match_index] = match_data
-
-				with open(self.calendar_name, 'r', encoding='utf-8') as file:
-					data_read = json.load(file)
-				data_read['data'] = self.matches
-
-				with open(self.calendar_name, 'w', encoding='utf-8') as file:
-					json.dump(data_read, file, indent=4, ensure_ascii=False)
-
-				logger.info(f'Match data updated! Match id: {match_data["id"]}')
+		with self._lock:
+			if not self._apply_match_data(match_data):
+				logger.error('Failed to found given match in db')
 				return
 
-		logger.error('Failed to found given match in db')
-		return
+			self.storage.save_match(match_data)
+
+		logger.info(f'Match data updated! Match id: {match_data["id"]}')
+
+	def update_matches_data(self, matches: list):
+		'''Updates calendar by data on several matches at once, writing them to storage in one go'''
+		with self._lock:
+			updated_matches = [m for m in matches if self._apply_match_data(m)]
+			if len(updated_matches) < len(matches):
+				logger.error(f'Failed to found {len(matches) - len(updated_matches)} of given matches in db')
+			if updated_matches:
+				self.storage.save_matches(updated_matches)
+
+		logger.info(f'Matches data updated! Match ids: {[m["id"] for m in updated_matches]}')
+
+	def _apply_match_data(self, match_data: dict) -> bool:
+		'''Replaces a match in memory by given match data. Returns False if there is no such match'''
+		match_index = self._match_positions.get(match_data['id'])
+		if match_index is None:
+			return False
+
+		old_match_data = self.matches[match_index]
+		self.matches[match_index] = match_data
+		self._reindex_match(old_match_data, match_data)
+		self.table.update_match(match_data, self._kickoffs[match_data['id']])
+		for team_id in {old_match_data['idHome'], old_match_data['idAway'], match_data['idHome'], match_data['idAway']}:
+			self._team_matches.pop(team_id, None)
+		if (old_match_data['timestamp'], old_match_data['round']) != (match_data['timestamp'], match_data['round']):
+			self._round_dates = None
+		return True
+
+	def is_match_changed(self, match_data: dict) -> bool:
+		'''Tells if match data given by API differs from the match stored in db'''
+		stored_match_data = self.read_match_data(match_data['id'])
+		if stored_match_data is None:
+			return True
+
+		if any(stored_match_data.get(f) != match_data.get(f) for f in MATCH_CHANGE_FIELDS):
+			return True
+		# kickoff time is only given by API at the very last moment
+		return stored_match_data['timestamp'] != util.match_timestamp(match_data['date'])
+
+	def is_events_changed(self, match_data: dict) -> bool:
+		'''Tells if events of a match given by API differ from events of the match stored in db'''
+		stored_match_data = self.read_match_data(match_data['id'])
+		if stored_match_data is None:
+			return True
+		return stored_match_data.get('eventsHash') != match_data.get('eventsHash')
+
+	def copy_match_events(self, match_data: dict):
+		'''Puts events of the match stored in db into given match data, if there are any stored'''
+		stored_match_data = self.read_match_data(match_data['id'])
+		if stored_match_data and 'events' in stored_match_data:
+			match_data['events'] = stored_match_data['events']
+		else:
+			match_data.pop('events', None)
 
 	def read_next_round_data(self, round: int) -> list:
 		'''Returns a list of matches in a given round'''
 		#TODO make controller know which round it is now
 		#TODO how to count tournament's max round in controller?
 
-		res =  [m for m in self.matches if m['round'] == round]
-		logger.info('Round {round} data successfully read')
+		res = list(self._matches_by_round.get(round, []))
+		logger.info(f'Round {round} data successfully read')
 		return res
 
+	def _read_team_matches(self, team_id: int) -> TeamMatches:
+		'''Returns kickoff ordered index of a team's matches'''
+		with self._lock:
+			if team_id not in self._team_matches:
+				self._team_matches[team_id] = TeamMatches(team_id, self._matches_by_team.get(team_id, []),
+														  self._kickoffs)
+			return self._team_matches[team_id]
+
 	def read_team_previous_matches(self, team_id:int, n:int, current_round:int) -> list:
 		'''Returns a list of n previous matches of a team_id'''
 		#TODO can return empty list in case current round 1
-		if current_round - n > 0:
-			rounds_needed = [r for r in range(current_round - n, current_round)]
-		else:
-			rounds_needed = [r for r in range(1, current_round)]
+		first_round_needed = max(current_round - n, 1)
 
-		res = []
-		for m in self.matches:
-			if m['round'] in rounds_needed:
-				if team_id in (m['idHome'], m['idAway']):
-					res.append(m)
-			elif m['round'] > current_round:
-				break
+		res = self._read_team_matches(team_id).read_rounds(first_round_needed, current_round - 1)
 
 		logger.info(f'Team {team_id} previous matches read successfully')
 		return res
 
+	def read_team_last_matches(self, team_id: int, n: int, before: datetime.datetime = None,
+							   venue: str = None) -> list:
+		'''Returns n last finished matches of a team kicked off before a given moment, latest first.
+		venue 'home' or 'away' only returns matches played at home or away. SQLiteStorage answers it with an indexed
+		query'''
+		if isinstance(self.storage, SQLiteStorage):
+			return self.storage.query_team_last_matches(self.season_id, team_id, n, before, venue)
+		return self._read_team_matches(team_id).read_last(n, before, venue)
+
+	def read_head_to_head(self, team_id: int, other_team_id: int, n: int) -> list:
+		'''Returns n last finished matches between two teams, latest first'''
+		return list(self._read_team_matches(team_id).read_head_to_head(other_team_id, n))
+
+	def read_team_form(self, team_id: int, n: int, venue: str = None) -> str:
+		'''Returns results of n last finished matches of a team like "WDLWW", latest last.
+		venue 'home' or 'away' only counts matches played at home or away'''
+		return self._read_team_matches(team_id).read_form(n, venue)
+
 	def read_team_previous_results(self, prev_matches: list) -> list:
 		'''Returns a list of results from given previous matches'''
 		res = []
@@ -132,13 +263,47 @@ class Database:
 			res.append({'round': round, 'teams': teams, 'score': score})
 		return res
 
+	def read_league_table(self) -> list:
+		'''Returns league table rows ordered by position'''
+		with self._lock:
+			return self.table.read_standings()
+
+	def is_league_table_valid(self) -> bool:
+		'''Tells if the incrementally updated league table equals one counted from scratch'''
+		table = LeagueTable()
+		with self._lock:
+			table.rebuild(self.matches, self._kickoffs)
+			return table.read_standings() == self.table.read_standings()
+
 	def read_match_data(self, match_id: int) -> Union[dict, None]:
 		'''Returns data on match_id'''
-		for m in self.matches:
-			if m['id'] == match_id:
-				logger.info(f'Data on {match_id} successfully read')
-				return m
-		return
+		match_index = self._match_positions.get(match_id)
+		if match_index is None:
+			return
+		logger.info(f'Data on {match_id} successfully read')
+		return self.matches[match_index]
+
+	def read_match_ids_by_round(self, round: int) -> list:
+		'''Returns ids of all matches in a given round'''
+		return [m['id'] for m in self._matches_by_round.get(round, [])]
+
+	def read_matches_by_date(self, date: datetime.date) -> list:
+		'''Returns a list of matches kicking off at a given date. SQLiteStorage answers it with an indexed query'''
+		if isinstance(self.storage, SQLiteStorage):
+			return self.storage.query_matches_by_date(self.season_id, date)
+		return list(self._matches_by_date.get(date, []))
+
+	def read_next_kickoff(self, after: datetime.datetime) -> Union[datetime.datetime, None]:
+		'''Returns the earliest kickoff later than given moment'''
+		return min((k for k in self._kickoffs.values() if k > after), default=None)
+
+	def is_season_finished(self) -> bool:
+		'''Tells if all the matches of the season are finished'''
+		return all(m['status'] == 'finished' for m in self.matches)
+
+	def read_match_kickoff(self, match_id: int) -> Union[datetime.datetime, None]:
+		'''Returns timezone aware kickoff datetime of a given match'''
+		return self._kickoffs.get(match_id)
 
 	def read_match_scorers(self, match_data:dict) -> Union[list, None]:
 		'''Returns a list of scores from a given match data'''
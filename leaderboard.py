@@ -0,0 +1,101 @@
+'''This module keeps users' standings by bet points overall, per season and per round.
+Standings are updated with points deltas of each settled match instead of being recounted from all the bets.'''
+
+import os
+import logging
+import bisect
+import threading
+import util
+from bets import BetBook, Settlement
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+
+class Leaderboard:
+	'''Users ordered by points. Users with equal points share a rank'''
+
+	def __init__(self, points: dict = None):
+		self.points = dict(points or {}) # user id -> points
+		self._ranking = sorted((-p, user_id) for user_id, p in self.points.items()) # (-points, user id), best first
+
+	def __len__(self):
+		return len(self._ranking)
+
+	def rank(self, user_id: int) -> int:
+		'''Returns rank of a user, None if the user has no points yet'''
+		if user_id not in self.points:
+			return None
+		return self._rank_of_points(self.points[user_id])
+
+	def _rank_of_points(self, points: int) -> int:
+		return bisect.bisect_left(self._ranking, (-points,)) + 1
+
+	def top(self, n: int) -> list:
+		'''Returns n best users as (rank, user id, points)'''
+		return [(self._rank_of_points(-p), user_id, -p) for p, user_id in self._ranking[:n]]
+
+	def apply(self, deltas: dict) -> list:
+		'''Adds points deltas given as {user id: points} and returns users whose rank changed as
+		(user id, old rank, new rank). Only users whose points lie between old and new points of a changed user can
+		move, so the rest of the board isn't looked at'''
+		moved = set(deltas)
+		for user_id, delta in deltas.items():
+			old_points = self.points.get(user_id, 0)
+			low, high = sorted((old_points, old_points + delta))
+			# users with points in [low, high) get one more or one less user above them
+			start = bisect.bisect_left(self._ranking, (-high + 1,))
+			end = bisect.bisect_left(self._ranking, (-low + 1,))
+			moved.update(user_id for _, user_id in self._ranking[start:end])
+		old_ranks = {user_id: self.rank(user_id) for user_id in moved}
+
+		for user_id, delta in deltas.items():
+			if user_id in self.points:
+				del self._ranking[bisect.bisect_left(self._ranking, (-self.points[user_id], user_id))]
+			self.points[user_id] = self.points.get(user_id, 0) + delta
+			bisect.insort(self._ranking, (-self.points[user_id], user_id))
+
+		return [(user_id, old_ranks[user_id], self.rank(user_id)) for user_id in moved
+				if old_ranks[user_id] != self.rank(user_id)]
+
+
+class Leaderboards:
+	'''Overall, season and round leaderboards of the season bets are taken on'''
+
+	def __init__(self):
+		self.overall = Leaderboard()
+		self.season = Leaderboard()
+		self.rounds = {} # round -> Leaderboard
+		self._lock = threading.Lock() # matches are settled from scheduler threads
+
+	def round(self, round: int) -> Leaderboard:
+		'''Returns leaderboard of a round'''
+		with self._lock:
+			return self.rounds.setdefault(round, Leaderboard())
+
+	def rebuild(self, bet_book: BetBook):
+		'''Counts all the leaderboards from settled bets. Needed once at start'''
+		db = bet_book.db
+		with self._lock:
+			self.overall = Leaderboard(bet_book.storage.load_points_by_user())
+			self.season = Leaderboard(bet_book.storage.load_points_by_user([m['id'] for m in db.matches]))
+			self.rounds = {r: Leaderboard(bet_book.storage.load_points_by_user(db.read_match_ids_by_round(r)))
+						   for r in range(1, db.count_max_rounds() + 1)}
+		logger.info(f'Leaderboards of {len(self.overall)} users rebuilt')
+
+	def apply(self, settlement: Settlement, round: int) -> dict:
+		'''Applies points deltas of a settled match of a given round to every leaderboard.
+		Returns moved users of each of them as {'overall' / 'season' / 'round': [(user id, old rank, new rank)]}'''
+		round_leaderboard = self.round(round)
+		with self._lock:
+			return {'overall': self.overall.apply(settlement.deltas),
+					'season': self.season.apply(settlement.deltas),
+					'round': round_leaderboard.apply(settlement.deltas)}
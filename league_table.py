@@ -0,0 +1,123 @@
+'''This module keeps the league table of a season: points, goal difference and form of every team.
+The table is kept by Database and updated by each finished match as it is stored, so asking for it costs nothing.'''
+
+import bisect
+import datetime
+
+WIN_POINTS = 3
+DRAW_POINTS = 1
+FORM_LENGTH = 5 # last results shown as team's form
+
+
+def read_match_goals(match_data: dict) -> tuple:
+	'''Returns (home goals, away goals) of a match the same way its score is counted'''
+	return (match_data['team_home_90min_goals'] + match_data['team_home_ET_goals'],
+			match_data['team_away_90min_goals'] + match_data['team_away_ET_goals'])
+
+
+class TeamRow:
+	'''League table row of a team'''
+
+	def __init__(self, team_id: int, name: str):
+		self.team_id = team_id
+		self.name = name
+		self.won = 0
+		self.drawn = 0
+		self.lost = 0
+		self.goals_for = 0
+		self.goals_against = 0
+		self.results = [] # (kickoff, match id, 'W' / 'D' / 'L') of counted matches ordered by kickoff
+
+	@property
+	def played(self) -> int:
+		return self.won + self.drawn + self.lost
+
+	@property
+	def points(self) -> int:
+		return self.won * WIN_POINTS + self.drawn * DRAW_POINTS
+
+	@property
+	def goal_difference(self) -> int:
+		return self.goals_for - self.goals_against
+
+	@property
+	def form(self) -> str:
+		'''Returns last FORM_LENGTH results like "WDLWW", latest last'''
+		return ''.join(r[2] for r in self.results[-FORM_LENGTH:])
+
+	def _count(self, kickoff: datetime.datetime, match_id: int, goals_for: int, goals_against: int, sign: int):
+		result = 'W' if goals_for > goals_against else 'L' if goals_for < goals_against else 'D'
+		if result == 'W':
+			self.won += sign
+		elif result == 'L':
+			self.lost += sign
+		else:
+			self.drawn += sign
+		self.goals_for += sign * goals_for
+		self.goals_against += sign * goals_against
+		if sign > 0:
+			bisect.insort(self.results, (kickoff, match_id, result))
+		else:
+			self.results.remove(next(r for r in self.results if r[1] == match_id))
+
+	def as_dict(self) -> dict:
+		return {'team_id': self.team_id, 'name': self.name, 'played': self.played, 'won': self.won,
+				'drawn': self.drawn, 'lost': self.lost, 'goals_for': self.goals_for,
+				'goals_against': self.goals_against, 'goal_difference': self.goal_difference,
+				'points': self.points, 'form': self.form}
+
+
+class LeagueTable:
+	'''Table of teams counted from finished matches. Matches are added and removed one by one as they change'''
+
+	def __init__(self):
+		self.rows = {} # team id -> TeamRow
+		self._counted = {} # match id -> match data counted into the table
+		self._standings = None # cached result of read_standings
+
+	def rebuild(self, matches: list, kickoffs: dict):
+		'''Counts the table from scratch from given matches and {match id: kickoff}'''
+		self.rows = {}
+		self._counted = {}
+		self._standings = None
+		for m in matches:
+			self.add_match(m, kickoffs[m['id']])
+
+	def _row(self, team_id: int, name: str) -> TeamRow:
+		if team_id not in self.rows:
+			self.rows[team_id] = TeamRow(team_id, name)
+		return self.rows[team_id]
+
+	def add_match(self, match_data: dict, kickoff: datetime.datetime):
+		'''Counts a match into the table if it is finished'''
+		# teams show up in the table before their first match is played
+		self._row(match_data['idHome'], match_data['homeName'])
+		self._row(match_data['idAway'], match_data['awayName'])
+		if match_data['status'] != 'finished':
+			return
+		self._count(match_data, kickoff, 1)
+		self._counted[match_data['id']] = match_data
+
+	def remove_match(self, match_id: int):
+		'''Takes a counted match out of the table'''
+		match_data = self._counted.pop(match_id, None)
+		if match_data:
+			self._count(match_data, None, -1)
+
+	def update_match(self, match_data: dict, kickoff: datetime.datetime):
+		'''Replaces a match counted into the table by its new data'''
+		self.remove_match(match_data['id'])
+		self.add_match(match_data, kickoff)
+
+	def _count(self, match_data: dict, kickoff: datetime.datetime, sign: int):
+		home_goals, away_goals = read_match_goals(match_data)
+		self.rows[match_data['idHome']]._count(kickoff, match_data['id'], home_goals, away_goals, sign)
+		self.rows[match_data['idAway']]._count(kickoff, match_data['id'], away_goals, home_goals, sign)
+		self._standings = None
+
+	def read_standings(self) -> list:
+		'''Returns table rows as dicts ordered by points, goal difference and goals scored'''
+		if self._standings is None:
+			rows = sorted(self.rows.values(), key=lambda r: (-r.points, -r.goal_difference, -r.goals_for, r.name))
+			self._standings = [dict(r.as_dict(), position=i) for i, r in enumerate(rows, 1)]
+		return [dict(r) for r in self._standings]
@@ -0,0 +1,96 @@
+'''This module contains helpers of live match tracking: how often to poll a match in play and which of its events
+are new since the last poll.'''
+
+import datetime
+from config import ALLOWED_REQUEST_INTERVAL
+
+LIVE_FAST_INTERVAL = 60 # seconds between polls of a match when something is about to happen
+LIVE_SLOW_INTERVAL = 300 # seconds between polls of a match in the middle of a half
+LIVE_API_SHARE = 0.5 # share of stat API requests live polling may take, the rest is left for other updates
+REQUESTS_PER_POLL = 2 # match data request plus events request when their hash changed
+HALF_TIME_END = (58, 70) # minutes after kickoff when the second half usually starts
+STOPPAGE_TIME_START = 43 # minute of a half after which stoppage time and the whistle are expected
+LIVE_POLL_CUTOFF = 3 * 60 * 60 # seconds after kickoff polling of a match that never got a final status is given up
+FINAL_STATUSES = ('finished', 'postponed', 'cancelled', 'canceled', 'abandoned', 'suspended', 'awarded')
+
+# what to do with a polled match, see read_poll_state
+POLL_CONTINUE = 'continue'
+POLL_FINISHED = 'finished'
+POLL_STOPPED = 'stopped'
+POLL_CUT_OFF = 'cut off'
+
+NOTIFIED_EVENTS = {
+	'goal': 'Гол',
+	'pen_scored': 'Гол с пенальти',
+	'own_goal': 'Автогол',
+	'y_card': 'Жёлтая карточка',
+	'y2_card': 'Вторая жёлтая карточка',
+	'r_card': 'Красная карточка',
+}
+
+
+def read_new_events(old_events: list, new_events: list) -> list:
+	'''Returns events from new_events that aren't in old_events and users should be notified about, in match order'''
+	old_event_ids = {e['id'] for e in old_events or []}
+	return sorted((e for e in new_events or [] if e['id'] not in old_event_ids and e['type'] in NOTIFIED_EVENTS),
+				  key=lambda e: (e['elapsed'], e.get('elapsedPlus') or 0))
+
+
+def format_event(event: dict, match_name: str) -> str:
+	'''Returns notification text about a match event'''
+	minute = f'{event["elapsed"]}+{event["elapsedPlus"]}' if event.get('elapsedPlus') else f'{event["elapsed"]}'
+	return f'{match_name}, {minute}\': {NOTIFIED_EVENTS[event["type"]]}! {event["teamName"]}, {event["player1Name"]}'
+
+
+def is_polling_over(match_data: dict) -> bool:
+	'''Tells if a match got a status after which it won't be played on today'''
+	return match_data['status'] in FINAL_STATUSES
+
+
+def is_past_cutoff(kickoff: datetime.datetime, now: datetime.datetime) -> bool:
+	'''Tells if a match should have got a final status long ago, e.g. as API keeps failing'''
+	return (now - kickoff).total_seconds() >= LIVE_POLL_CUTOFF
+
+
+def read_poll_state(match_data: dict, kickoff: datetime.datetime, now: datetime.datetime) -> str:
+	'''Tells what to do with a match polled in play: POLL_FINISHED to settle it, POLL_STOPPED to stop polling it
+	as it won't be played on today, POLL_CUT_OFF to give it up at LIVE_POLL_CUTOFF or else POLL_CONTINUE'''
+	if match_data['status'] == 'finished':
+		return POLL_FINISHED
+	if is_polling_over(match_data):
+		return POLL_STOPPED
+	if is_past_cutoff(kickoff, now):
+		return POLL_CUT_OFF
+	return POLL_CONTINUE
+
+
+def format_result(match_name: str, score: str) -> str:
+	'''Returns notification text about a finished match result'''
+	return f'Матч {match_name} завершился!\nСчёт {score}'
+
+
+def format_poll_stop(match_name: str, status: str, state: str) -> str:
+	'''Returns admin notice about a match whose polling stopped before it finished'''
+	if state == POLL_CUT_OFF:
+		return (f'Match {match_name} is still {status} {LIVE_POLL_CUTOFF // 3600} hours after kickoff. '
+				f'Polling stopped, bets on it are not settled')
+	return f'Match {match_name} is {status}, polling stopped'
+
+
+def count_poll_interval(match_data: dict, kickoff: datetime.datetime, now: datetime.datetime,
+						live_matches: int = 1) -> float:
+	'''Returns seconds till the next poll of a live match. Matches are polled fast around kickoff, the end of
+	half-time and in stoppage time, otherwise slow. The interval is never shorter than live_matches polled together
+	can afford within LIVE_API_SHARE of ALLOWED_REQUEST_INTERVAL'''
+	minutes_played = (now - kickoff).total_seconds() / 60
+	elapsed = match_data.get('elapsed') or 0
+	if match_data['status'] == 'not started':
+		fast = True # kickoff is late
+	else:
+		fast = (bool(match_data.get('elapsedPlus'))
+				or STOPPAGE_TIME_START <= elapsed <= 45
+				or elapsed >= 45 + STOPPAGE_TIME_START
+				or HALF_TIME_END[0] <= minutes_played <= HALF_TIME_END[1])
+	interval = LIVE_FAST_INTERVAL if fast else LIVE_SLOW_INTERVAL
+	budget_interval = live_matches * REQUESTS_PER_POLL * ALLOWED_REQUEST_INTERVAL / LIVE_API_SHARE
+	return max(interval, budget_interval)
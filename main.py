@@ -1,8 +1,15 @@
-import threading
-from controller import Controller
-
-c = Controller()
+import sys
 
 if __name__ == '__main__':
-	threading.Thread(target=c.exec_schedule).start()
-	threading.Thread(target=c.bot.polling(none_stop=True, interval=0)).start()
\ No newline at end of file
+	if 'asyncio' in sys.argv[1:]: # python main.py asyncio
+		import asyncio
+		from async_controller import AsyncController
+		asyncio.run(AsyncController().run())
+	else:
+		from controller import Controller
+		c = Controller()
+		c.track_schedule() # runs in scheduler's own threads
+		if 'webhook' in sys.argv[1:]: # python main.py webhook, needs WEBHOOK_URL in config
+			c.serve_webhook()
+		else:
+			c.bot.polling(none_stop=True, interval=0)
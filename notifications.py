@@ -0,0 +1,83 @@
+'''This module merges notifications fired at about the same time into one message per chat.
+When several matches finish together every user gets one digest instead of a message per match.'''
+
+import os
+import logging
+import threading
+from typing import Callable
+import util
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+WINDOW = 30 # seconds notifications are collected for before a digest is sent
+DIGEST_SEPARATOR = '\n\n'
+
+
+class NotificationAggregator:
+	'''Collects notifications for all users or for given chats and turns them into one digest per chat.
+	Chats getting the same digest are grouped so that it can be broadcast at once'''
+
+	def __init__(self, read_all_chat_ids: Callable[[], list]):
+		self.read_all_chat_ids = read_all_chat_ids
+		self._notifications = [] # (text, chat ids or None for all users)
+		self._lock = threading.Lock()
+
+	def add(self, text: str, chat_ids: list = None) -> bool:
+		'''Adds a notification for given chats or for all users if chat_ids is None.
+		Returns True if it is the first notification of a new digest'''
+		with self._lock:
+			self._notifications.append((text, None if chat_ids is None else list(chat_ids)))
+			return len(self._notifications) == 1
+
+	def collect(self) -> dict:
+		'''Returns collected notifications as {digest text: [chat ids]} and starts a new digest'''
+		with self._lock:
+			notifications, self._notifications = self._notifications, []
+		if not notifications:
+			return {}
+
+		chat_texts = {} # chat id -> list of texts in order they were added
+		all_chat_ids = None
+		for text, chat_ids in notifications:
+			if chat_ids is None:
+				all_chat_ids = all_chat_ids if all_chat_ids is not None else self.read_all_chat_ids()
+				chat_ids = all_chat_ids
+			for chat_id in chat_ids:
+				chat_texts.setdefault(chat_id, []).append(text)
+
+		digests = {}
+		for chat_id, texts in chat_texts.items():
+			digests.setdefault(DIGEST_SEPARATOR.join(texts), []).append(chat_id)
+		logger.info(f'{len(notifications)} notifications merged into {len(digests)} digests for {len(chat_texts)} chats')
+		return digests
+
+
+class DigestSender:
+	'''Sends digests of a NotificationAggregator with send(chat_ids, text) WINDOW seconds after the first
+	notification of a digest was added'''
+
+	def __init__(self, aggregator: NotificationAggregator, send: Callable[[list, str], object], window: float = WINDOW):
+		self.aggregator = aggregator
+		self.send = send
+		self.window = window
+		self._timer = None
+
+	def add(self, text: str, chat_ids: list = None):
+		'''Adds a notification for given chats or for all users if chat_ids is None'''
+		if self.aggregator.add(text, chat_ids):
+			self._timer = threading.Timer(self.window, self.flush)
+			self._timer.daemon = True
+			self._timer.start()
+
+	def flush(self) -> list:
+		'''Sends collected digests right away. Returns whatever send returned for each of them'''
+		return [self.send(chat_ids, digest) for digest, chat_ids in self.aggregator.collect().items()]
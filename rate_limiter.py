@@ -0,0 +1,47 @@
+'''This module contains a token bucket rate limiter shared by everything that makes requests to stat API.'''
+
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+	'''Lets through rate requests per second on average and up to capacity requests in a burst.
+	Is thread safe so one bucket can be shared by all the threads making requests'''
+
+	def __init__(self, rate: float, capacity: int = 1):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated_at = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+		self.updated_at = now
+
+	def try_acquire(self) -> float:
+		'''Takes a token if there is one and returns 0. Otherwise returns seconds left till the next token'''
+		with self._lock:
+			self._refill()
+			if self.tokens >= 1:
+				self.tokens -= 1
+				return 0
+			return (1 - self.tokens) / self.rate
+
+	def acquire(self):
+		'''Blocks until a token is taken'''
+		while True:
+			wait_time = self.try_acquire()
+			if not wait_time:
+				return
+			time.sleep(wait_time)
+
+	async def acquire_async(self):
+		'''Waits without blocking event loop until a token is taken'''
+		while True:
+			wait_time = self.try_acquire()
+			if not wait_time:
+				return
+			await asyncio.sleep(wait_time)
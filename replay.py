@@ -0,0 +1,230 @@
+'''This module replays recorded seasons offline: a stand-in for stat API serves matches of a stored calendar as they
+were at the moment shown by a virtual clock, which runs many times faster than the wall clock.
+Run python replay.py <season id> <date as dd.mm.yyyy> [speed] to replay a match day with Controller. Works on a copy
+of Database folder so stored calendars stay untouched, and prints messages the bot would have sent.'''
+
+import os
+import sys
+import logging
+import json
+import math
+import shutil
+import tempfile
+import hashlib
+import datetime
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+import util
+import controller
+import notifications
+import broadcast
+import stat_api_handler
+from rate_limiter import TokenBucket
+from database import Database
+from config import STAT_API_URL, ALLOWED_REQUEST_INTERVAL, PREFERRED_TIME_FORMAT
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+REPLAY_SPEED = 600 # virtual seconds per real second, a match takes about 11 real seconds
+FIXTURES_PAGE_SIZE = 50 # matches per page of fixtures list
+FIRST_HALF_END = 47 # minutes after kickoff the first half ends at
+SECOND_HALF_START = 62 # minutes after kickoff the second half starts at
+MATCH_END = 112 # minutes after kickoff the match is finished at
+GOAL_EVENTS = ('goal', 'pen_scored', 'own_goal')
+REPLAY_CHAT_ID = 0 # user added to the replayed bot so that users' messages are seen too
+
+
+class VirtualClock(util.Clock):
+	'''Clock starting at a given moment and running speed times faster than the wall clock'''
+
+	def __init__(self, start: datetime.datetime, speed: float = REPLAY_SPEED):
+		self.start = start
+		self.speed = speed
+		self._started_at = time.monotonic()
+
+	def now(self) -> datetime.datetime:
+		return self.start + datetime.timedelta(seconds=(time.monotonic() - self._started_at) * self.speed)
+
+	def seconds_till(self, date_time_obj: datetime.datetime) -> float:
+		return (date_time_obj - self.now()).total_seconds() / self.speed
+
+
+def event_minute(event: dict) -> float:
+	'''Returns minutes after kickoff an event happened at, counting half-time break'''
+	minute = event['elapsed'] + (event.get('elapsedPlus') or 0)
+	return minute if event['elapsed'] <= 45 else minute + SECOND_HALF_START - 45
+
+
+def read_match_state(match_data: dict, now: datetime.datetime) -> dict:
+	'''Returns data on a recorded match as API would have given it at a given moment. Matches which weren't
+	finished when recorded are given as recorded once they are over'''
+	kickoff = util.kickoff_from_timestamp(match_data['timestamp']) if 'timestamp' in match_data \
+		else util.parse_match_date(match_data['date'])
+	minutes = (now - kickoff).total_seconds() / 60
+	state = {k: v for k, v in match_data.items() if k not in ('score', 'timestamp')}
+	state['date'] = kickoff.strftime('%Y-%m-%d %H:%M:%S')
+	if minutes >= MATCH_END or match_data['status'] != 'finished':
+		return state
+
+	events = [e for e in match_data.get('events') or [] if event_minute(e) <= minutes]
+	for side in ('home', 'away'):
+		for period in ('90min', 'ET', 'PEN', '1stHalf', '2ndHalf'):
+			state[f'team_{side}_{period}_goals'] = 0
+	for e in events:
+		if e['type'] in GOAL_EVENTS:
+			side = 'home' if e['idTeam'] == match_data['idHome'] else 'away'
+			state[f'team_{side}_90min_goals'] += 1
+	if minutes < 0:
+		state.update(status='not started', elapsed=0, elapsedPlus=0)
+	elif minutes < FIRST_HALF_END:
+		state.update(status='in progress', elapsed=min(int(minutes), 45), elapsedPlus=max(int(minutes) - 45, 0))
+	elif minutes < SECOND_HALF_START:
+		state.update(status='in progress', elapsed=45, elapsedPlus=0)
+	else:
+		played = int(minutes) - SECOND_HALF_START + 45
+		state.update(status='in progress', elapsed=min(played, 90), elapsedPlus=max(played - 90, 0))
+	state['events'] = events
+	state['eventsHash'] = hashlib.sha1(json.dumps([e['id'] for e in events]).encode()).hexdigest()
+	return state
+
+
+class ReplayAdapter(BaseAdapter):
+	'''Transport adapter answering stat API requests from recorded calendars at the moment shown by a clock.
+	Mounted on a StatAPIHandler session in place of the network'''
+
+	def __init__(self, calendars: dict, clock: util.Clock):
+		super().__init__()
+		self.calendars = calendars # season id -> list of recorded matches
+		self.clock = clock
+		self.matches = {m['id']: m for matches in calendars.values() for m in matches}
+		self.requests_count = 0
+		self._lock = threading.Lock()
+
+	def send(self, request, **kwargs):
+		with self._lock:
+			self.requests_count += 1
+		url = urlparse(request.url)
+		query = parse_qs(url.query)
+		parts = url.path.strip('/').split('/')[1:] # dropping API version
+		try:
+			status_code, payload = self._answer(parts, query)
+		except (KeyError, ValueError, IndexError):
+			status_code, payload = 404, {'message': f'Nothing recorded for {url.path}'}
+		return self._build_response(request, status_code, payload)
+
+	def _answer(self, parts: list, query: dict) -> tuple:
+		now = self.clock.now()
+		if parts[0] == 'fixtures':
+			match_data = read_match_state(self.matches[int(parts[1])], now)
+			if query.get('events', ['False'])[0].lower() != 'true':
+				match_data.pop('events', None)
+			return 200, {'data': [match_data]}
+
+		if parts[0] == 'seasons' and parts[2] == 'fixtures':
+			matches = self.calendars[int(parts[1])]
+			page = int(query.get('page', ['1'])[0])
+			pages_count = math.ceil(len(matches) / FIXTURES_PAGE_SIZE)
+			page_matches = matches[(page - 1) * FIXTURES_PAGE_SIZE:page * FIXTURES_PAGE_SIZE]
+			data = []
+			for m in page_matches:
+				match_data = read_match_state(m, now)
+				match_data.pop('events', None)
+				data.append(match_data)
+			return 200, {'data': data, 'pagination': {'page': page, 'itemsPerPage': FIXTURES_PAGE_SIZE,
+													  'total': len(matches), 'totalPages': pages_count,
+													  'hasNextPage': page < pages_count}}
+
+		any_match = next(iter(self.matches.values()))
+		if parts[0] == 'countries' and len(parts) == 1:
+			return 200, {'data': [{'id': any_match['idCountry'], 'name': any_match['countryName']}]}
+		if parts[0] == 'countries' and parts[2] == 'leagues':
+			return 200, {'data': [{'id': any_match['idLeague'], 'name': any_match['leagueName']}]}
+		if parts[0] == 'leagues' and parts[2] == 'seasons':
+			return 200, {'data': [{'id': season_id} for season_id in sorted(self.calendars, reverse=True)]}
+		raise KeyError(parts[0])
+
+	@staticmethod
+	def _build_response(request, status_code: int, payload: dict) -> requests.Response:
+		response = requests.Response()
+		response.status_code = status_code
+		response._content = json.dumps(payload, ensure_ascii=False).encode()
+		response.headers = CaseInsensitiveDict({'Content-Type': 'application/json'})
+		response.encoding = 'utf-8'
+		response.url = request.url
+		response.request = request
+		return response
+
+	def close(self):
+		pass
+
+
+def install(session: requests.Session, adapter: ReplayAdapter):
+	'''Makes a session send stat API requests to a replay adapter'''
+	session.mount(STAT_API_URL, adapter)
+
+
+def replay_match_day(season_id: int, date: datetime.date, speed: float = REPLAY_SPEED) -> list:
+	'''Replays a match day of a stored season with Controller from an hour before its first kickoff till its last
+	match is over. Returns (virtual time, chat id, text) of every message the bot sent'''
+	db = Database()
+	if db.read_calendar(season_id) is None:
+		return []
+	day_kickoffs = sorted(db.read_match_kickoff(m['id']) for m in db.read_matches_by_date(date))
+	if not day_kickoffs:
+		logger.error(f'No matches of season id {season_id} at {date}')
+		return []
+
+	clock = VirtualClock(day_kickoffs[0] - datetime.timedelta(hours=1), speed)
+	util.set_clock(clock)
+	# API plan, Telegram limits and notification window are kept in virtual time
+	stat_api_handler.rate_limiter = TokenBucket(rate=speed / ALLOWED_REQUEST_INTERVAL,
+												capacity=stat_api_handler.RATE_LIMIT_BURST)
+	broadcast.GLOBAL_RATE *= speed
+	broadcast.CHAT_RATE *= speed
+	notifications.WINDOW /= speed
+
+	c = controller.Controller()
+	c.db.read_calendar(season_id)
+	c.leaderboards.rebuild(c.bets)
+	install(c.sah.session, ReplayAdapter({season_id: [dict(m) for m in db.matches]}, clock))
+	sent = []
+	c.bot.send_message = lambda chat_id, text, **kwargs: sent.append((clock.now(), chat_id, text))
+	c.bot.digests.window = notifications.WINDOW
+	c.bot.users.add(REPLAY_CHAT_ID)
+	c.track_schedule()
+
+	util.wait_until(day_kickoffs[-1] + datetime.timedelta(minutes=MATCH_END + 10))
+	c.scheduler.stop(wait=True)
+	c.bot.digests.flush()
+	c.bot.broadcaster.queue.join()
+	return sent
+
+
+if __name__ == '__main__':
+	season_id = int(sys.argv[1])
+	date = datetime.datetime.strptime(sys.argv[2], PREFERRED_TIME_FORMAT.split()[0]).date()
+	speed = float(sys.argv[3]) if len(sys.argv) > 3 else REPLAY_SPEED
+
+	# replaying on a copy of Database folder so that stored calendars are left as they are
+	replay_dir = tempfile.mkdtemp(prefix='betbot replay ')
+	shutil.copytree('Database', os.path.join(replay_dir, 'Database'))
+	os.chdir(replay_dir)
+	try:
+		for moment, chat_id, text in replay_match_day(season_id, date, speed):
+			print(f'{moment.strftime(PREFERRED_TIME_FORMAT)} -> {chat_id}: {text}\n')
+	finally:
+		os.chdir(os.path.dirname(os.path.abspath(__file__)))
+		shutil.rmtree(replay_dir, ignore_errors=True)
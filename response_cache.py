@@ -0,0 +1,113 @@
+'''This module keeps stat API responses which hardly ever change, like countries, leagues and seasons, on disk.
+Responses are kept for a TTL and revalidated with ETag / Last-Modified after it, and the most used ones are also kept
+in memory so that repeated lookups don't even read a file.'''
+
+import os
+import logging
+import json
+import codec
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Union
+import util
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+CACHE_TTL = 7 * 24 * 60 * 60 # seconds a response is used without asking API if it changed
+MEMORY_CACHE_SIZE = 128 # responses kept in memory in front of the files
+
+
+class CachedResponse:
+	'''Stored response which can be used in place of requests.Response by the code reading it'''
+
+	def __init__(self, entry: dict):
+		self.status_code = entry['status_code']
+		self.text = entry['text']
+		self.headers = entry['headers']
+		self.from_cache = True
+
+	def json(self):
+		return codec.loads(self.text)
+
+
+class ResponseCache:
+	'''Keeps GET responses in files named by hash of their url and query under cache_dir'''
+
+	cache_dir = os.path.join('Database', 'Cache')
+
+	def __init__(self, cache_dir: str = None, ttl: int = CACHE_TTL, memory_size: int = MEMORY_CACHE_SIZE):
+		self.cache_dir = cache_dir or ResponseCache.cache_dir
+		self.ttl = ttl
+		self.memory_size = memory_size
+		self._memory = OrderedDict() # key -> entry, least recently used first
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def make_key(url: str, params: dict = None) -> str:
+		'''Returns cache key of a request'''
+		query = json.dumps(params or {}, sort_keys=True)
+		return hashlib.sha1(f'{url}?{query}'.encode()).hexdigest()
+
+	def _path(self, key: str) -> str:
+		return os.path.join(self.cache_dir, f'{key}.json')
+
+	def read(self, key: str) -> Union[dict, None]:
+		'''Returns a stored entry, fresh or not, None if there is no such entry'''
+		with self._lock:
+			if key in self._memory:
+				self._memory.move_to_end(key)
+				return self._memory[key]
+
+		try:
+			entry = codec.load_file(self._path(key))
+		except (OSError, codec.DecodeError):
+			return None
+		self._remember(key, entry)
+		return entry
+
+	def is_fresh(self, entry: dict, ttl: int = None) -> bool:
+		'''Tells if an entry can be used without revalidation. self.ttl is used unless ttl is given'''
+		return time.time() - entry['stored_at'] < (self.ttl if ttl is None else ttl)
+
+	def write(self, key: str, status_code: int, text: str, headers: dict):
+		'''Stores a response'''
+		entry = {'stored_at': time.time(), 'status_code': status_code, 'text': text,
+				 'headers': {h: headers[h] for h in ('ETag', 'Last-Modified') if h in headers}}
+		self._dump(key, entry)
+
+	def refresh(self, key: str, entry: dict):
+		'''Restarts TTL of an entry API said is still valid'''
+		self._dump(key, dict(entry, stored_at=time.time()))
+
+	def _dump(self, key: str, entry: dict):
+		util.insure_dir_exists(self.cache_dir)
+		codec.dump_file(self._path(key), entry)
+		self._remember(key, entry)
+
+	def _remember(self, key: str, entry: dict):
+		with self._lock:
+			self._memory[key] = entry
+			self._memory.move_to_end(key)
+			while len(self._memory) > self.memory_size:
+				self._memory.popitem(last=False)
+
+	@staticmethod
+	def revalidation_headers(entry: dict) -> dict:
+		'''Returns headers asking API to answer 304 if a stored response is still valid'''
+		headers = {}
+		if 'ETag' in entry['headers']:
+			headers['If-None-Match'] = entry['headers']['ETag']
+		if 'Last-Modified' in entry['headers']:
+			headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+		return headers
@@ -0,0 +1,142 @@
+'''This module contains a scheduler which runs jobs at given moments on a bounded pool of worker threads.
+All the jobs wait in one heap ordered by time so the number of threads doesn't depend on the number of jobs.'''
+
+import os
+import logging
+import heapq
+import itertools
+import threading
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
+import util
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+WORKERS = 4 # threads running due jobs
+
+
+class Job:
+	'''A function to be called with given args at run_at'''
+
+	def __init__(self, run_at: datetime.datetime, func: Callable, args: tuple, key: str = None):
+		self.run_at = run_at
+		self.func = func
+		self.args = args
+		self.key = key
+		self.cancelled = False
+
+	def __repr__(self):
+		return f'Job({self.key or self.func.__name__} at {self.run_at})'
+
+
+class Scheduler:
+	'''Keeps jobs in a heap ordered by their time. One dispatcher thread sleeps till the earliest job is due and hands
+	due jobs over to a pool of worker threads. Jobs given a key can be cancelled or rescheduled by it'''
+
+	def __init__(self, workers: int = WORKERS):
+		self._heap = []
+		self._jobs = {} # key -> job
+		self._counter = itertools.count() # tells apart jobs due at the same moment so that they run in given order
+		self._condition = threading.Condition()
+		self._executor = ThreadPoolExecutor(max_workers=workers)
+		self._dispatcher = None
+		self._running = False
+
+	def schedule(self, run_at: datetime.datetime, func: Callable, *args, key: str = None) -> Job:
+		'''Adds a job to run func(*args) at run_at. Naive datetime objects are treated as local time.
+		A job already scheduled with the same key is cancelled'''
+		if run_at.tzinfo is None:
+			run_at = run_at.astimezone()
+		job = Job(run_at, func, args, key)
+
+		with self._condition:
+			if key is not None:
+				self._cancel(key)
+				self._jobs[key] = job
+			heapq.heappush(self._heap, (run_at, next(self._counter), job))
+			self._condition.notify()
+
+		logger.info(f'{job} scheduled')
+		return job
+
+	def reschedule(self, key: str, run_at: datetime.datetime) -> Union[Job, None]:
+		'''Moves a job with a given key to run_at. Returns None if there is no such job'''
+		with self._condition:
+			job = self._jobs.get(key)
+			if job is None:
+				return None
+			return self.schedule(run_at, job.func, *job.args, key=key)
+
+	def cancel(self, key: str) -> bool:
+		'''Cancels a job with a given key. Returns False if there is no such job'''
+		with self._condition:
+			return self._cancel(key)
+
+	def _cancel(self, key: str) -> bool:
+		job = self._jobs.pop(key, None)
+		if job is None:
+			return False
+		# cancelled jobs stay in the heap and are dropped by the dispatcher when they are due
+		job.cancelled = True
+		return True
+
+	def read_job(self, key: str) -> Union[Job, None]:
+		'''Returns a pending job with a given key'''
+		with self._condition:
+			return self._jobs.get(key)
+
+	def start(self):
+		'''Starts dispatching jobs'''
+		with self._condition:
+			if self._running:
+				return
+			self._running = True
+		self._dispatcher = threading.Thread(target=self._dispatch, name='scheduler', daemon=True)
+		self._dispatcher.start()
+
+	def stop(self, wait: bool = True):
+		'''Stops dispatching jobs. Jobs already running are finished'''
+		with self._condition:
+			self._running = False
+			self._condition.notify()
+		if self._dispatcher:
+			self._dispatcher.join()
+		self._executor.shutdown(wait=wait)
+
+	def _dispatch(self):
+		with self._condition:
+			while self._running:
+				if not self._heap:
+					self._condition.wait()
+					continue
+
+				run_at, _, job = self._heap[0]
+				seconds_left = util.clock.seconds_till(run_at)
+				if seconds_left > 0:
+					# woken up earlier if a job is added or the scheduler is stopped
+					self._condition.wait(seconds_left)
+					continue
+
+				heapq.heappop(self._heap)
+				if job.cancelled:
+					continue
+				if job.key is not None:
+					del self._jobs[job.key]
+				self._executor.submit(self._run, job)
+
+	@staticmethod
+	def _run(job: Job):
+		try:
+			job.func(*job.args)
+		except Exception:
+			logger.exception(f'{job} failed')
@@ -2,20 +2,36 @@
 URL: https://rapidapi.com/mararrdeveloper/api/elenasport-io1/.'''
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urljoin
 from config import STAT_API_URL, STAT_API_KEY, TEAMNAME_TRANSLATION, TOURNAMENT_NAME, COUNTRY_NAME, \
 	ALLOWED_REQUEST_INTERVAL, PREFERRED_TIME_FORMAT
-import json
 import os
 import logging
 from typing import Union
 import util
 import datetime
 import time
+import math
+from concurrent.futures import ThreadPoolExecutor
+from storage import JSONStorage, SQLiteStorage
+from rate_limiter import TokenBucket
+from response_cache import ResponseCache, CachedResponse
 
 HEADERS = {'x-rapidapi-key': STAT_API_KEY,
 		   'x-rapidapi-host': "elenasport-io1.p.rapidapi.com"
 		   }
+POOL_SIZE = 10 # kept-alive connections to the API, at least as many as matches tracked at the same time
+TIMEOUT = (5, 30) # seconds to connect and to wait for a response
+RETRIES = 3 # retries of requests failed with connection errors, 429 or 5xx responses
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF = 1 # retries are made after 1, 2, 4 ... seconds unless API tells when to retry with Retry-After
+RATE_LIMIT_BURST = 1 # requests that can be made at once before ALLOWED_REQUEST_INTERVAL starts to apply
+SEASONS_CACHE_TTL = 24 * 60 * 60 # seconds league seasons are cached for so that a new season is noticed soon
+
+# Shared by every StatAPIHandler and thread so that all the requests of the process fit API plan together
+rate_limiter = TokenBucket(rate=1 / ALLOWED_REQUEST_INTERVAL, capacity=RATE_LIMIT_BURST)
 
 util.insure_dir_exists('Logs')
 log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
@@ -29,9 +45,76 @@ logger.addHandler(log_file_handler)
 log_file_handler.setFormatter(log_formatter)
 
 class StatAPIHandler:
-	def __init__(self):
+	def __init__(self, pool_size: int = POOL_SIZE, cache: ResponseCache = None):
 		# TODO add country, league and other id's gathered with coressponding methods
-		pass
+		self.pool_size = pool_size
+		self.cache = cache or ResponseCache() # reference data like countries, leagues and seasons
+		self.session = requests.Session()
+		self.session.headers.update(HEADERS)
+		# only requests that never reached API are retried by urllib3, the rest are retried by _get so that every
+		# attempt takes a token from rate limiter
+		retry = Retry(total=None, connect=RETRIES, read=0, status=0, other=0, backoff_factor=RETRY_BACKOFF)
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+		self.session.mount('https://', adapter)
+		self.session.mount('http://', adapter)
+
+	def _get(self, url: str, params: dict = None, headers: dict = None) -> Union[requests.Response, None]:
+		'''Makes GET request through the pooled session once rate limiter lets it through, retrying on connection
+		errors, 429 and 5xx. Returns None if no response was received or retries ended with 429 or 5xx'''
+		r = None
+		for attempt in range(RETRIES + 1):
+			rate_limiter.acquire()
+			try:
+				r = self.session.get(url, params=params, headers=headers, timeout=TIMEOUT)
+				if r.status_code not in RETRY_STATUSES:
+					return r
+				retry_after = r.headers.get('Retry-After')
+			except requests.RequestException as e:
+				logger.error(f'Request to {url} failed: {e}')
+				r, retry_after = None, None
+
+			if attempt < RETRIES:
+				time.sleep(float(retry_after) if retry_after and retry_after.isdigit()
+						   else RETRY_BACKOFF * 2 ** attempt)
+
+		if r is not None:
+			logger.error(f'Request to {url} failed {RETRIES + 1} times, last with {StatAPIHandler.read_error(r)}')
+		else:
+			logger.error(f'Request to {url} failed {RETRIES + 1} times')
+		return None
+
+	@staticmethod
+	def read_error(r: Union[requests.Response, CachedResponse]) -> str:
+		'''Returns message of an error response. Error bodies aren't always json, e.g. of a proxy in front of API'''
+		try:
+			return r.json()['message']
+		except (ValueError, KeyError, TypeError):
+			return f'{r.status_code} {r.text[:200]}'
+
+	def _get_cached(self, url: str, params: dict = None,
+					ttl: int = None) -> Union[requests.Response, CachedResponse, None]:
+		'''Makes GET request of data that hardly ever changes. Responses are kept in self.cache and only asked
+		again after ttl (cache TTL by default), with ETag / Last-Modified so that API can answer 304 if nothing
+		changed. A stale response is used if API can't be reached or answers anything but 200 or 304'''
+		key = ResponseCache.make_key(url, params)
+		entry = self.cache.read(key)
+		if entry and self.cache.is_fresh(entry, ttl):
+			return CachedResponse(entry)
+
+		r = self._get(url, params, headers=ResponseCache.revalidation_headers(entry) if entry else None)
+		if r is None:
+			return CachedResponse(entry) if entry else None
+
+		if r.status_code == requests.codes.not_modified and entry:
+			self.cache.refresh(key, entry)
+			return CachedResponse(entry)
+		if r.status_code == requests.codes.ok:
+			self.cache.write(key, r.status_code, r.text, r.headers)
+			return r
+		if entry:
+			logger.error(f'Request to {url} failed with {StatAPIHandler.read_error(r)}, stale response is used')
+			return CachedResponse(entry)
+		return r
 
 	def get_country_id_by_name(self) -> Union[int, None]:
 		# based on API's allCountries method. Gets country's id in API.
@@ -39,10 +122,12 @@ class StatAPIHandler:
 		country_name = COUNTRY_NAME
 		querystring = {"name": country_name}
 		url = urljoin(STAT_API_URL, endpoint)
-		r = requests.get(url, headers=HEADERS, params=querystring)
+		r = self._get_cached(url, params=querystring)
+		if r is None:
+			return None
 
 		if not r.status_code == requests.codes.ok:
-			logger.error(f'Bad request:{r.json()["message"]} Arg passed: {country_name}')
+			logger.error(f'Bad request:{StatAPIHandler.read_error(r)} Arg passed: {country_name}')
 			return None
 
 		if r.json()['data'] == []:  # country doesn't exist
@@ -55,10 +140,12 @@ class StatAPIHandler:
 		# based on API's leaguesByCountryId method. Gets config.TOURNAMENT_NAME's id in API.
 		endpoint = '/v2/countries/:id/leagues'
 		url = urljoin(STAT_API_URL, endpoint.replace(':id', str(country_id)))
-		r = requests.get(url, headers=HEADERS)
+		r = self._get_cached(url)
+		if r is None:
+			return None
 
 		if not r.status_code == requests.codes.ok:
-			logger.error(f'Bad request:{r.json()["message"]} Arg passed: {country_id}')
+			logger.error(f'Bad request:{StatAPIHandler.read_error(r)} Arg passed: {country_id}')
 			return None
 
 		leagues_in_country = r.json()['data']
@@ -73,75 +160,113 @@ class StatAPIHandler:
 		# gets current season id based on a league id. Based on a seasonsByLeagueId method. Returns string
 		endpoint = '/v2/leagues/:id/seasons'
 		url = urljoin(STAT_API_URL, endpoint.replace(':id', str(league_id)))
-		r = requests.get(url, headers=HEADERS)
+		r = self._get_cached(url, ttl=SEASONS_CACHE_TTL)
+		if r is None:
+			return None
 
 		if not r.status_code == requests.codes.ok:
-			logger.error(f'Bad request:{r.json()["message"]} Arg passed: {league_id}')
+			logger.error(f'Bad request:{StatAPIHandler.read_error(r)} Arg passed: {league_id}')
 			return None
 
 		return r.json()['data'][0]['id']
 
-	def get_season_calendar(self, season_id):
-		'''Downloads all the info on a season by given season_id and dumps all the data into a calendar_filename txt
-		file to be used as a database. Based on API's fixturesBySeasonId method'''
+	def get_season_calendar(self, season_id, storage: Union[JSONStorage, SQLiteStorage] = None,
+							concurrent: bool = True):
+		'''Downloads all the info on a season by given season_id and saves it with storage (JSONStorage by default)
+		as a calendar to be used as a database. Based on API's fixturesBySeasonId method.
+		Pages are collected in memory and the calendar is written once, so a failed download never leaves a
+		half-written calendar behind'''
+
+		storage = storage or JSONStorage()
+		matches = self.fetch_season_fixtures(season_id, concurrent)
+		if matches is None:
+			return
+
+		calendar = {'data': [StatAPIHandler.prepare_match_data(m) for m in matches]}
+		calendar['season id'] = season_id # adding season id to dict to tell one calendar from another
+		storage.save_calendar(calendar, season_id)
+		logger.info(f'Calendar of season id {season_id} successfully created')
+
+	def get_season_fixtures(self, season_id: int, round: int = None, date: datetime.date = None) -> Union[list, None]:
+		'''Returns data on all the matches of a season played in a given round and/or at a given date.
+		Refreshes a whole match day with a couple of fixtures list requests instead of a request per match.
+		Fixtures list has no events in it, they must be requested by match id'''
+		matches = self.fetch_season_fixtures(season_id)
+		if matches is None:
+			return None
+
+		if round is not None:
+			matches = [m for m in matches if m['round'] == round]
+		if date is not None:
+			matches = [m for m in matches if util.parse_match_date(m['date']).date() == date]
+		return matches
 
-		calendar_filename = f'calendar season id_{season_id}.txt'
+	def fetch_season_fixtures(self, season_id: int, concurrent: bool = True) -> Union[list, None]:
+		'''Returns data on all the matches of a season as it is given by API. Based on API's fixturesBySeasonId method.
+		If concurrent is True and first page tells how many pages there are, the rest of them are downloaded in
+		parallel as fast as rate limiter allows'''
 		endpoint = '/v2/seasons/:id/fixtures'
 		url = urljoin(STAT_API_URL, endpoint.replace(':id', str(season_id)))
-		querystring = {"page": "1"}
-
-		response_has_next_page = True
-		r_time = None #setting request time to None to tell first request from subsequent
-		while response_has_next_page:
-			if r_time: #if this request is not first and we have to check if we satisfy ALLOWED_REQUEST_INTERVAL
-				since_last_r = datetime.datetime.now() - r_time #time since last req
-				if since_last_r < datetime.timedelta(seconds=ALLOWED_REQUEST_INTERVAL): #too early for new req
-					time_too_wait = datetime.timedelta(seconds=ALLOWED_REQUEST_INTERVAL) - since_last_r
-					time.sleep(time_too_wait.total_seconds())
-			r_time = datetime.datetime.now()
-			r = requests.get(url, headers=HEADERS, params=querystring)
-
-			if not r.status_code == requests.codes.ok:
-				logger.error(f'Bad request:{r.json()["message"]} Arg passed: {season_id}')
-				return
-
-			r = r.json()
-			page_data = r['pagination'] # we remember this part
-			del (r['pagination']) #and right off the bat get rid of it because we don't need to store it
-
-			matches = r['data']
-			for match in matches:
-				# translating team names from english
-				translated_home_name = StatAPIHandler.translate_team_name(match['homeName'])
-				translated_away_name = StatAPIHandler.translate_team_name(match['awayName'])
-				match['homeName'], match['awayName'] = translated_home_name, translated_away_name
-
-				# formatting date
-				match['date'] = StatAPIHandler.format_time(match['date'])
-
-			if querystring['page'] == '1':
-				util.insure_dir_exists(os.path.join('Database', 'Calendars'))
-				calendar_path = os.path.join('Database','Calendars', calendar_filename)
-				r['season id'] = season_id # adding season id to dict to tell one calendar from another
-				with open(calendar_path, 'w', encoding='utf-8') as file:
-					json.dump(r, file, indent=4, ensure_ascii=False)
-			else:
-				with open(calendar_path, 'r', encoding='utf-8') as file:
-					data_to_dump = json.load(file)
-				for match in r['data']:
-					data_to_dump['data'].append(match)
-				with open(calendar_path, 'w', encoding='utf-8') as file:
-					json.dump(data_to_dump, file, indent=4, ensure_ascii=False)
-
-			if page_data['hasNextPage']:
-				querystring['page'] = str(int(querystring['page']) + 1)
-			else:
-				response_has_next_page = False
-
-		logger.info(f'Calendar {calendar_path} successfully created')
-
-	def get_match_data_by_id(self, match_id:int) -> Union[dict, None]:
+
+		first_page = self._get_fixtures_page(url, 1)
+		if first_page is None:
+			return None
+		pages = [first_page]
+
+		pages_count = StatAPIHandler._count_pages(first_page['pagination'])
+		if concurrent and pages_count:
+			with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+				pages += executor.map(lambda page: self._get_fixtures_page(url, page), range(2, pages_count + 1))
+			if None in pages:
+				return None
+		else:
+			while pages[-1]['pagination']['hasNextPage']:
+				page = self._get_fixtures_page(url, len(pages) + 1)
+				if page is None:
+					return None
+				pages.append(page)
+
+		return [match for page in pages for match in page['data']]
+
+	def _get_fixtures_page(self, url: str, page: int) -> Union[dict, None]:
+		'''Returns one page of fixtures list found by url'''
+		r = self._get(url, params={'page': str(page)})
+		if r is None:
+			return None
+
+		if not r.status_code == requests.codes.ok:
+			logger.error(f'Bad request:{StatAPIHandler.read_error(r)} Arg passed: {url}, page {page}')
+			return None
+
+		try:
+			page_data = r.json()
+		except ValueError:
+			logger.error(f'Fixtures page is not json: {r.text[:200]} Arg passed: {url}, page {page}')
+			return None
+		if 'data' not in page_data or 'pagination' not in page_data:
+			logger.error(f'Fixtures page has no data or pagination. Arg passed: {url}, page {page}')
+			return None
+		return page_data
+
+	@staticmethod
+	def _count_pages(pagination: dict) -> Union[int, None]:
+		'''Returns number of pages reported in pagination part of a response or None if it isn't there'''
+		if 'totalPages' in pagination:
+			return int(pagination['totalPages'])
+		if 'total' in pagination and pagination.get('itemsPerPage'):
+			return math.ceil(pagination['total'] / pagination['itemsPerPage'])
+		return None
+
+	def get_match_data_by_id(self, match_id:int, events: bool = True) -> Union[dict, None]:
 		'''Gets info on a match with match_id. Based on API's fixtureById method'''
+		r = self.fetch_match_data_by_id(match_id, events)
+		if r is None:
+			return None
+		return StatAPIHandler.prepare_match_data(r)
+
+	def fetch_match_data_by_id(self, match_id:int, events: bool = True) -> Union[dict, None]:
+		'''Gets info on a match with match_id as it is given by API, without translation and added fields.
+		Events are only requested if events is True'''
 
 		if not isinstance(match_id, int):
 			logger.error(f'Match id must be an integer. Arg passed: {match_id}')
@@ -149,15 +274,29 @@ class StatAPIHandler:
 
 		endpoint = '/v2/fixtures/:id'
 		url = urljoin(STAT_API_URL, endpoint.replace(':id', str(match_id)))
-		querystring = {'events': True}
-		r = requests.get(url, headers=HEADERS, params=querystring)
+		querystring = {'events': True} if events else None
+		r = self._get(url, params=querystring)
+		if r is None:
+			return None
 
 		if not r.status_code == requests.codes.ok:
-			logger.error(f'Bad request:{r.json()["message"]} Arg passed: {match_id}')
+			logger.error(f'Bad request:{StatAPIHandler.read_error(r)} Arg passed: {match_id}')
 			return None
 
-		r = r.json()['data'][0]
-		r['date'] = StatAPIHandler.format_time(r['date'])
+		try:
+			data = r.json()['data']
+		except (ValueError, KeyError, TypeError):
+			logger.error(f'Match data is not in response: {r.text[:200]} Arg passed: {match_id}')
+			return None
+		if not data:
+			logger.error(f'No match with id {match_id}')
+			return None
+		return data[0]
+
+	@staticmethod
+	def prepare_match_data(r: dict) -> dict:
+		'''Translates match data given by API and adds timestamp and score to it'''
+		r['timestamp'] = util.match_timestamp(r['date'])
 
 		translated_home_name = StatAPIHandler.translate_team_name(r['homeName'])
 		translated_away_name = StatAPIHandler.translate_team_name(r['awayName'])
@@ -168,7 +307,7 @@ class StatAPIHandler:
 		away_score = r["team_away_90min_goals"] + r["team_away_ET_goals"]
 		r['score'] = f'{home_score}-{away_score}'
 
-		for e in r['events']:
+		for e in r.get('events', []):
 			translated_team_name = StatAPIHandler.translate_team_name(e['teamName'])
 			e['teamName'] = translated_team_name
 
@@ -0,0 +1,374 @@
+'''This module contains storage backends used by Database to keep calendars and seasons.
+JSONStorage keeps them in text files under Database folder, SQLiteStorage keeps them in a single SQLite database.'''
+
+import os
+import logging
+import codec
+import sqlite3
+import threading
+import datetime
+from typing import Union
+import util
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+JOURNAL_COMPACTION_THRESHOLD = 200 # journal entries after which the journal is folded back into the calendar file
+KICKOFF_FORMAT = '%Y-%m-%d %H:%M' # sortable format SQLiteStorage keeps kickoff times in, in util.API_TIMEZONE
+
+
+class JSONStorage:
+	'''Keeps every calendar in its own text file and appends match updates to a journal next to it'''
+
+	calendar_db_dir = os.path.join('Database', 'Calendars')
+	seasons_db_dir = os.path.join('Database', 'Seasons')
+	seasons_db_filename = 'seasons.txt'
+	seasons_db_path = os.path.join(seasons_db_dir, seasons_db_filename)
+
+	def __init__(self):
+		self.content = {}
+		self.calendar_name = ''
+		self.journal_name = ''
+		self._journal_entries = 0
+
+	@staticmethod
+	def calendar_path(season_id: int) -> str:
+		'''Returns path of a calendar file of a given season'''
+		return os.path.join(JSONStorage.calendar_db_dir, f'calendar season id_{season_id}.txt')
+
+	@staticmethod
+	def journal_path(calendar_path: str) -> str:
+		'''Returns path of a journal kept next to a given calendar file'''
+		return os.path.splitext(calendar_path)[0] + '.journal'
+
+	def load_calendar(self, season_id: int) -> Union[dict, None]:
+		'''Returns calendar of a given season with all the journaled match updates applied'''
+		db_path = JSONStorage.calendar_path(season_id)
+
+		if not os.path.exists(db_path):
+			logger.error(f'Database doesn\'t exist in provided path: {db_path}')
+			return None
+
+		self.calendar_name = db_path
+		self.journal_name = JSONStorage.journal_path(db_path)
+
+		self.content = codec.load_file(db_path)
+		self._replay_journal()
+		return self.content
+
+	def _replay_journal(self):
+		'''Applies match updates written into the journal after the calendar file was last dumped'''
+		self._journal_entries = 0
+		if not os.path.exists(self.journal_name):
+			return
+
+		matches = self.content['data']
+		match_positions = {m['id']: i for i, m in enumerate(matches)}
+		offset = 0
+		good_end = 0 # offset right after the last entry read successfully
+		with open(self.journal_name, 'rb+') as file:
+			for line in file:
+				offset += len(line)
+				try:
+					# the last line can be cut short if the process died while appending it
+					if not line.endswith(b'\n'):
+						raise codec.DecodeError('Journal entry has no line end')
+					match_data = codec.loads(line)
+				except codec.DecodeError:
+					logger.error(f'Skipping corrupt journal entry in {self.journal_name}')
+					continue
+				if match_data['id'] in match_positions:
+					matches[match_positions[match_data['id']]] = match_data
+				self._journal_entries += 1
+				good_end = offset
+
+			# a torn tail is cut off, otherwise the next entry appended would be glued to it and lost too
+			if offset > good_end:
+				logger.error(f'Truncating corrupt tail of {self.journal_name} at byte {good_end}')
+				file.truncate(good_end)
+
+		logger.info(f'{self._journal_entries} journal entries replayed from {self.journal_name}')
+
+	def save_calendar(self, content: dict, season_id: int):
+		'''Replaces calendar file of a given season with given content in one atomic write'''
+		db_path = JSONStorage.calendar_path(season_id)
+		util.insure_dir_exists(JSONStorage.calendar_db_dir)
+		codec.dump_file(db_path, content)
+		# updates journaled for the previous version of the calendar must not be replayed over the new one
+		journal_path = JSONStorage.journal_path(db_path)
+		if os.path.exists(journal_path):
+			os.remove(journal_path)
+		logger.info(f'Calendar of season id {season_id} saved into {db_path}')
+
+	def save_match(self, match_data: dict):
+		'''Appends one line with given match data to the journal and makes sure it reached the disk.
+		Match data must already be in the calendar returned by load_calendar'''
+		self.save_matches([match_data])
+
+	def save_matches(self, matches: list):
+		'''Appends a line per given match to the journal with a single write and fsync'''
+		with open(self.journal_name, 'a', encoding='utf-8') as file:
+			file.write(''.join(codec.dumps(m) + '\n' for m in matches))
+			file.flush()
+			os.fsync(file.fileno())
+		self._journal_entries += len(matches)
+
+		if self._journal_entries >= JOURNAL_COMPACTION_THRESHOLD:
+			self.compact()
+
+	def compact(self):
+		'''Dumps loaded calendar into its file and empties the journal'''
+		codec.dump_file(self.calendar_name, self.content)
+		# the journal is only dropped once the calendar file holding all its updates is in place
+		if os.path.exists(self.journal_name):
+			os.remove(self.journal_name)
+		self._journal_entries = 0
+		logger.info(f'Journal compacted into {self.calendar_name}')
+
+	def load_seasons(self) -> list:
+		'''Returns a list of seasons stored in seasons db file'''
+		if not os.path.exists(JSONStorage.seasons_db_path):
+			logger.error('No file found to read from')
+			return []
+
+		return codec.load_file(JSONStorage.seasons_db_path)
+
+	def save_seasons(self, seasons: list):
+		'''Dumps given seasons into seasons db file'''
+		util.insure_dir_exists(JSONStorage.seasons_db_dir)
+		codec.dump_file(JSONStorage.seasons_db_path, seasons)
+
+
+class SQLiteStorage:
+	'''Keeps calendars and seasons in a SQLite database. Matches, events, seasons and round dates are separate indexed
+	tables so that match day and team form queries don't need the whole calendar'''
+
+	db_path = os.path.join('Database', 'betbot.sqlite3')
+
+	def __init__(self, db_path: str = None):
+		self.db_path = db_path or SQLiteStorage.db_path
+		self.calendar_name = self.db_path
+		self.season_id = None
+		self._local = threading.local() # sqlite connections can't be shared between tracker threads
+		self._create_tables()
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		'''Returns connection of the current thread'''
+		if not hasattr(self._local, 'connection'):
+			connection = sqlite3.connect(self.db_path, timeout=30)
+			connection.row_factory = sqlite3.Row
+			# WAL lets tracker threads read while another thread writes
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute('PRAGMA synchronous=NORMAL')
+			self._local.connection = connection
+		return self._local.connection
+
+	def _create_tables(self):
+		with self.connection as c:
+			c.executescript('''
+				CREATE TABLE IF NOT EXISTS calendars (
+					season_id INTEGER PRIMARY KEY,
+					data TEXT NOT NULL
+				);
+				CREATE TABLE IF NOT EXISTS matches (
+					id INTEGER PRIMARY KEY,
+					season_id INTEGER NOT NULL,
+					position INTEGER NOT NULL,
+					round INTEGER NOT NULL,
+					id_home INTEGER NOT NULL,
+					id_away INTEGER NOT NULL,
+					kickoff TEXT NOT NULL,
+					status TEXT,
+					has_events INTEGER NOT NULL,
+					data TEXT NOT NULL
+				);
+				CREATE INDEX IF NOT EXISTS matches_season_position ON matches (season_id, position);
+				CREATE INDEX IF NOT EXISTS matches_season_round ON matches (season_id, round);
+				CREATE INDEX IF NOT EXISTS matches_season_kickoff ON matches (season_id, kickoff);
+				CREATE INDEX IF NOT EXISTS matches_home_kickoff ON matches (id_home, kickoff);
+				CREATE INDEX IF NOT EXISTS matches_away_kickoff ON matches (id_away, kickoff);
+				CREATE TABLE IF NOT EXISTS events (
+					id INTEGER NOT NULL,
+					match_id INTEGER NOT NULL,
+					position INTEGER NOT NULL,
+					type TEXT,
+					elapsed INTEGER,
+					data TEXT NOT NULL,
+					PRIMARY KEY (match_id, position)
+				);
+				CREATE TABLE IF NOT EXISTS seasons (
+					position INTEGER PRIMARY KEY,
+					season_id INTEGER NOT NULL,
+					data TEXT NOT NULL
+				);
+				CREATE TABLE IF NOT EXISTS round_dates (
+					season_id INTEGER NOT NULL,
+					round INTEGER NOT NULL,
+					start_date TEXT NOT NULL,
+					finish_date TEXT NOT NULL,
+					PRIMARY KEY (season_id, round)
+				);
+			''')
+
+	def load_calendar(self, season_id: int) -> Union[dict, None]:
+		'''Returns calendar of a given season assembled from matches and events tables'''
+		row = self.connection.execute('SELECT data FROM calendars WHERE season_id = ?', (season_id,)).fetchone()
+		if not row:
+			logger.error(f'No calendar of season id {season_id} in {self.db_path}')
+			return None
+
+		self.season_id = season_id
+		content = codec.loads(row['data'])
+		content['data'] = self._read_matches('WHERE season_id = ? ORDER BY position', (season_id,))
+		return content
+
+	def _read_matches(self, condition: str, params: tuple) -> list:
+		'''Returns matches with their events selected from matches table by given SQL condition'''
+		rows = self.connection.execute(f'SELECT id, has_events, data FROM matches {condition}', params).fetchall()
+		matches = [codec.loads(r['data']) for r in rows]
+		for m in matches:
+			# Database gives a timestamp to matches of calendars downloaded before they had one, query rows need it too
+			if 'timestamp' not in m:
+				m['timestamp'] = util.match_timestamp(m['date'])
+
+		match_ids = [r['id'] for r in rows if r['has_events']]
+		events = {}
+		# selecting in chunks to stay under sqlite's limit on the number of query parameters
+		for i in range(0, len(match_ids), 500):
+			chunk = match_ids[i:i + 500]
+			for e in self.connection.execute(f'SELECT match_id, data FROM events '
+											 f'WHERE match_id IN ({",".join("?" * len(chunk))}) '
+											 f'ORDER BY match_id, position', chunk):
+				events.setdefault(e['match_id'], []).append(codec.loads(e['data']))
+
+		for r, m in zip(rows, matches):
+			if r['has_events']:
+				m['events'] = events.get(r['id'], [])
+		return matches
+
+	def save_calendar(self, content: dict, season_id: int):
+		'''Replaces calendar of a given season with given content'''
+		calendar_data = {k: v for k, v in content.items() if k != 'data'}
+		with self.connection as c:
+			c.execute('INSERT OR REPLACE INTO calendars (season_id, data) VALUES (?, ?)',
+					  (season_id, codec.dumps(calendar_data)))
+			c.execute('DELETE FROM events WHERE match_id IN (SELECT id FROM matches WHERE season_id = ?)', (season_id,))
+			c.execute('DELETE FROM matches WHERE season_id = ?', (season_id,))
+			for position, match_data in enumerate(content['data']):
+				self._write_match(c, match_data, season_id, position)
+		logger.info(f'Calendar of season id {season_id} saved into {self.db_path}')
+
+	def save_match(self, match_data: dict):
+		'''Replaces a match and its events by given match data in one transaction'''
+		self.save_matches([match_data])
+
+	def save_matches(self, matches: list):
+		'''Replaces given matches and their events in one transaction'''
+		with self.connection as c:
+			for match_data in matches:
+				row = c.execute('SELECT season_id, position FROM matches WHERE id = ?', (match_data['id'],)).fetchone()
+				if not row:
+					logger.error(f'No match id {match_data["id"]} in {self.db_path}')
+					continue
+				self._write_match(c, match_data, row['season_id'], row['position'])
+
+	@staticmethod
+	def _write_match(c: sqlite3.Connection, match_data: dict, season_id: int, position: int):
+		match_row = {k: v for k, v in match_data.items() if k != 'events'}
+		if 'timestamp' in match_data:
+			kickoff = util.kickoff_from_timestamp(match_data['timestamp'])
+		else:
+			kickoff = util.parse_match_date(match_data['date'])
+		kickoff = kickoff.strftime(KICKOFF_FORMAT)
+		c.execute('INSERT OR REPLACE INTO matches '
+				  '(id, season_id, position, round, id_home, id_away, kickoff, status, has_events, data) '
+				  'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+				  (match_data['id'], season_id, position, match_data['round'], match_data['idHome'],
+				   match_data['idAway'], kickoff, match_data['status'], 'events' in match_data,
+				   codec.dumps(match_row)))
+
+		c.execute('DELETE FROM events WHERE match_id = ?', (match_data['id'],))
+		c.executemany('INSERT INTO events (id, match_id, position, type, elapsed, data) VALUES (?, ?, ?, ?, ?, ?)',
+					  [(e['id'], match_data['id'], i, e['type'], e['elapsed'], codec.dumps(e))
+					   for i, e in enumerate(match_data.get('events') or [])])
+
+	def compact(self):
+		'''Moves WAL contents into the main database file'''
+		self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+	def load_seasons(self) -> list:
+		'''Returns a list of seasons with their round dates'''
+		seasons = []
+		for row in self.connection.execute('SELECT season_id, data FROM seasons ORDER BY position'):
+			season = codec.loads(row['data'])
+			season['round_dates'] = {str(r['round']): [r['start_date'], r['finish_date']]
+									 for r in self.connection.execute('SELECT round, start_date, finish_date '
+																	  'FROM round_dates WHERE season_id = ? '
+																	  'ORDER BY round', (row['season_id'],))}
+			seasons.append(season)
+		return seasons
+
+	def save_seasons(self, seasons: list):
+		'''Replaces all the seasons and their round dates by given seasons'''
+		with self.connection as c:
+			c.execute('DELETE FROM seasons')
+			c.execute('DELETE FROM round_dates')
+			for position, season in enumerate(seasons):
+				season_row = {k: v for k, v in season.items() if k != 'round_dates'}
+				c.execute('INSERT INTO seasons (position, season_id, data) VALUES (?, ?, ?)',
+						  (position, season['season_id'], codec.dumps(season_row)))
+				c.executemany('INSERT OR REPLACE INTO round_dates (season_id, round, start_date, finish_date) '
+							  'VALUES (?, ?, ?, ?)',
+							  [(season['season_id'], int(r), d[0], d[1])
+							   for r, d in season.get('round_dates', {}).items()])
+
+	def query_matches_by_date(self, season_id: int, date: datetime.date) -> list:
+		'''Returns matches of a season kicking off at a given date'''
+		day_start = datetime.datetime.combine(date, datetime.time())
+		day_end = day_start + datetime.timedelta(days=1)
+		return self._read_matches('WHERE season_id = ? AND kickoff >= ? AND kickoff < ? ORDER BY kickoff',
+								  (season_id, day_start.strftime(KICKOFF_FORMAT), day_end.strftime(KICKOFF_FORMAT)))
+
+	def query_team_last_matches(self, season_id: int, team_id: int, n: int, before: datetime.datetime = None,
+								venue: str = None) -> list:
+		'''Returns n last finished matches of a team in a season kicked off before a given moment, latest first.
+		venue 'home' or 'away' only returns matches played at home or away'''
+		kickoff_condition, params = '', ()
+		if before is not None:
+			kickoff_condition = 'AND kickoff < ? '
+			params = (before.astimezone(util.API_TIMEZONE).strftime(KICKOFF_FORMAT),)
+		# one indexed select per venue instead of an OR so that sqlite walks each team index backwards from given time
+		selects = [f'SELECT id FROM (SELECT id FROM matches WHERE {column} = ? AND season_id = ? '
+				   f'{kickoff_condition}AND status = \'finished\' ORDER BY kickoff DESC LIMIT ?)'
+				   for v, column in (('home', 'id_home'), ('away', 'id_away')) if venue in (None, v)]
+		return self._read_matches(f'WHERE id IN ({" UNION ALL ".join(selects)}) ORDER BY kickoff DESC LIMIT ?',
+								  (team_id, season_id, *params, n) * len(selects) + (n,))
+
+
+def import_json_database(sqlite_storage: SQLiteStorage = None):
+	'''Copies all the calendars and seasons kept by JSONStorage into a SQLite database'''
+	sqlite_storage = sqlite_storage or SQLiteStorage()
+	json_storage = JSONStorage()
+
+	for filename in sorted(os.listdir(JSONStorage.calendar_db_dir)):
+		if not (filename.startswith('calendar season id_') and filename.endswith('.txt')):
+			continue
+		season_id = int(filename[len('calendar season id_'):-len('.txt')])
+		content = json_storage.load_calendar(season_id)
+		sqlite_storage.save_calendar(content, season_id)
+
+	sqlite_storage.save_seasons(json_storage.load_seasons())
+	logger.info(f'JSON database imported into {sqlite_storage.db_path}')
+
+
+if __name__ == '__main__':
+	import_json_database()
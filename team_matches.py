@@ -0,0 +1,58 @@
+'''This module contains an index of a team's matches ordered by kickoff.
+Last results, home or away form and head-to-head queries are slices of its lists instead of calendar scans.'''
+
+import bisect
+import datetime
+from league_table import read_match_goals
+
+
+def read_team_result(match_data: dict, team_id: int) -> str:
+	'''Returns 'W', 'D' or 'L' result of a finished match for a given team'''
+	home_goals, away_goals = read_match_goals(match_data)
+	goals_for, goals_against = (home_goals, away_goals) if match_data['idHome'] == team_id else (away_goals, home_goals)
+	return 'W' if goals_for > goals_against else 'L' if goals_for < goals_against else 'D'
+
+
+class TeamMatches:
+	'''Matches of a team ordered by kickoff. Finished ones are also kept split by venue along with their kickoffs
+	so that "before a moment" is a bisect. Query results are kept in self.cache till the index is dropped'''
+
+	def __init__(self, team_id: int, matches: list, kickoffs: dict):
+		self.team_id = team_id
+		self.matches = sorted(matches, key=lambda m: kickoffs[m['id']])
+		self.rounds = {} # round -> matches of the round
+		for m in self.matches:
+			self.rounds.setdefault(m['round'], []).append(m)
+
+		finished = [m for m in self.matches if m['status'] == 'finished']
+		self.finished = {None: finished, # venue -> finished matches
+						 'home': [m for m in finished if m['idHome'] == team_id],
+						 'away': [m for m in finished if m['idAway'] == team_id]}
+		self.kickoffs = {venue: [kickoffs[m['id']] for m in venue_matches]
+						 for venue, venue_matches in self.finished.items()}
+		self.cache = {}
+
+	def read_last(self, n: int, before: datetime.datetime = None, venue: str = None) -> list:
+		'''Returns n last finished matches kicked off before a given moment, at home or away if venue is given,
+		latest first'''
+		matches = self.finished[venue]
+		end = len(matches) if before is None else bisect.bisect_left(self.kickoffs[venue], before)
+		return matches[max(end - n, 0):end][::-1]
+
+	def read_head_to_head(self, other_team_id: int, n: int) -> list:
+		'''Returns n last finished matches against another team, latest first'''
+		key = ('head to head', other_team_id)
+		if key not in self.cache:
+			self.cache[key] = [m for m in self.finished[None] if other_team_id in (m['idHome'], m['idAway'])][::-1]
+		return self.cache[key][:n]
+
+	def read_form(self, n: int, venue: str = None) -> str:
+		'''Returns results of n last finished matches like "WDLWW", latest last'''
+		key = ('form', n, venue)
+		if key not in self.cache:
+			self.cache[key] = ''.join(read_team_result(m, self.team_id) for m in reversed(self.read_last(n, venue=venue)))
+		return self.cache[key]
+
+	def read_rounds(self, first_round: int, last_round: int) -> list:
+		'''Returns matches of rounds from first_round to last_round including both'''
+		return [m for r in range(first_round, last_round + 1) for m in self.rounds.get(r, [])]
@@ -0,0 +1,20 @@
+'''Tests import the bot modules from the repo root and run in a copy of Database, so they never touch real data.
+Like the bot itself they need config.py'''
+
+import os
+import sys
+import shutil
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEASON_ID = 4208 # season kept in Database/Calendars that tests read
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+	'''Runs a test in a temporary directory with a copy of Database'''
+	shutil.copytree(os.path.join(ROOT, 'Database'), tmp_path / 'Database')
+	monkeypatch.chdir(tmp_path)
+	return tmp_path
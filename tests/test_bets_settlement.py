@@ -0,0 +1,69 @@
+'''BetBook settlement: numpy and pure python passes give the same points and deltas'''
+
+import random
+import itertools
+import pytest
+import bets
+from conftest import SEASON_ID
+from bets import BetBook, BetStorage, Scoring
+from database import Database
+from storage import JSONStorage
+
+np = pytest.importorskip('numpy')
+
+USERS = 50
+
+
+def make_bet_book(tmp_path, name: str) -> BetBook:
+	db = Database(storage=JSONStorage())
+	db.read_calendar(SEASON_ID)
+	return BetBook(db, BetStorage(str(tmp_path / f'{name}.sqlite3')))
+
+
+def place_random_bets(bet_book: BetBook, match_ids: list, seed: int):
+	'''Stores random bets of USERS users, a third of them already settled with random points'''
+	rng = random.Random(seed)
+	rows = [(match_id, user_id, rng.randint(0, 4), rng.randint(0, 4), 0)
+			for match_id in match_ids for user_id in range(USERS) if rng.random() < 0.8]
+	bet_book.storage.save_bets(rows)
+	bet_book.storage.save_points([(match_id, user_id, rng.randint(0, 3))
+								  for match_id, user_id, *_ in rows if rng.random() < 0.3])
+
+
+def read_settlements(settlements: dict) -> dict:
+	return {match_id: (s.points, s.deltas) for match_id, s in settlements.items()}
+
+
+def test_count_points_array_matches_count_points():
+	scoring = Scoring()
+	grid = np.array(list(itertools.product(range(5), repeat=4)))
+	points = scoring.count_points_array(grid[:, 0], grid[:, 1], grid[:, 2], grid[:, 3])
+	assert points.tolist() == [scoring.count_points(*row) for row in grid.tolist()]
+
+
+def test_numpy_and_python_settlements_are_equal(workdir, monkeypatch):
+	numpy_book = make_bet_book(workdir, 'numpy')
+	python_book = make_bet_book(workdir, 'python')
+	match_ids = [m['id'] for m in numpy_book.db.matches if m['status'] == 'finished'][:40]
+	assert match_ids
+	for bet_book in (numpy_book, python_book):
+		place_random_bets(bet_book, match_ids, seed=1)
+
+	numpy_settlements = numpy_book.settle_matches(match_ids)
+	monkeypatch.setattr(bets, 'np', None)
+	python_settlements = python_book.settle_matches(match_ids)
+
+	assert read_settlements(numpy_settlements) == read_settlements(python_settlements)
+	assert numpy_book.storage.load_bets(match_ids) == python_book.storage.load_bets(match_ids)
+	assert any(s.deltas for s in python_settlements.values())
+
+
+def test_settling_again_changes_nothing(workdir):
+	bet_book = make_bet_book(workdir, 'numpy')
+	match_ids = [m['id'] for m in bet_book.db.matches if m['status'] == 'finished'][:10]
+	place_random_bets(bet_book, match_ids, seed=2)
+
+	first = bet_book.settle_matches(match_ids)
+	again = bet_book.settle_matches(match_ids)
+	assert {i: s.points for i, s in again.items()} == {i: s.points for i, s in first.items()}
+	assert all(not s.deltas for s in again.values())
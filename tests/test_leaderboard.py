@@ -0,0 +1,46 @@
+'''Leaderboard.apply: ranks and moved users found by bisect ranges equal those of a ranking counted from scratch'''
+
+import random
+import pytest
+from leaderboard import Leaderboard
+
+
+def count_ranks(points: dict) -> dict:
+	'''Rank of every user is one more than the number of users with more points'''
+	return {user_id: 1 + sum(other > p for other in points.values()) for user_id, p in points.items()}
+
+
+def count_moves(old_points: dict, deltas: dict) -> set:
+	new_points = dict(old_points)
+	for user_id, delta in deltas.items():
+		new_points[user_id] = new_points.get(user_id, 0) + delta
+	old_ranks, new_ranks = count_ranks(old_points), count_ranks(new_points)
+	return {(user_id, old_ranks.get(user_id), new_ranks[user_id]) for user_id in new_points
+			if old_ranks.get(user_id) != new_ranks[user_id]}
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_apply_matches_ranking_from_scratch(seed):
+	rng = random.Random(seed)
+	users = rng.randint(1, 30)
+	points = {user_id: rng.randint(0, 10) for user_id in range(users)}
+	leaderboard = Leaderboard(points)
+	for _ in range(5):
+		# settlements bring points to a few known users and to some new ones, a corrected result takes points away
+		deltas = {user_id: rng.randint(-3, 3) for user_id in rng.sample(range(users + 5), rng.randint(1, 6))}
+		deltas = {user_id: delta for user_id, delta in deltas.items()
+				  if points.get(user_id, 0) + delta >= 0}
+		expected_moves = count_moves(points, deltas)
+		for user_id, delta in deltas.items():
+			points[user_id] = points.get(user_id, 0) + delta
+
+		assert set(leaderboard.apply(deltas)) == expected_moves
+		assert leaderboard.points == points
+		assert {user_id: leaderboard.rank(user_id) for user_id in points} == count_ranks(points)
+
+
+def test_top_shares_ranks_of_equal_points():
+	leaderboard = Leaderboard({1: 5, 2: 7, 3: 5, 4: 0})
+	assert leaderboard.top(3) == [(1, 2, 7), (2, 1, 5), (2, 3, 5)]
+	assert leaderboard.rank(4) == 4
+	assert leaderboard.rank(5) is None
@@ -0,0 +1,75 @@
+'''JSONStorage journal: replay of match updates and truncation of a torn tail'''
+
+import os
+from conftest import SEASON_ID
+from storage import JSONStorage
+
+
+def load_storage() -> JSONStorage:
+	storage = JSONStorage()
+	assert storage.load_calendar(SEASON_ID) is not None
+	return storage
+
+
+def updated_match(storage: JSONStorage, i: int, score: str) -> dict:
+	match_data = dict(storage.content['data'][i])
+	match_data['score'] = score
+	return match_data
+
+
+def test_journaled_updates_are_replayed(workdir):
+	storage = load_storage()
+	storage.save_match(updated_match(storage, 0, '5-5'))
+	storage.save_matches([updated_match(storage, 1, '1-1'), updated_match(storage, 0, '6-5')])
+
+	replayed = load_storage()
+	assert replayed.content['data'][0]['score'] == '6-5'
+	assert replayed.content['data'][1]['score'] == '1-1'
+	assert replayed._journal_entries == 3
+
+
+def test_torn_tail_is_truncated(workdir):
+	storage = load_storage()
+	storage.save_match(updated_match(storage, 0, '5-5'))
+	journal_size = os.path.getsize(storage.journal_name)
+	# the process died while appending the next entry
+	with open(storage.journal_name, 'ab') as file:
+		file.write(b'{"id": 1, "sco')
+
+	replayed = load_storage()
+	assert replayed.content['data'][0]['score'] == '5-5'
+	assert replayed._journal_entries == 1
+	assert os.path.getsize(replayed.journal_name) == journal_size
+
+	# an entry appended after the truncation isn't glued to the torn one and survives the next replay
+	replayed.save_match(updated_match(replayed, 1, '2-0'))
+	again = load_storage()
+	assert again.content['data'][0]['score'] == '5-5'
+	assert again.content['data'][1]['score'] == '2-0'
+	assert again._journal_entries == 2
+
+
+def test_corrupt_entry_in_the_middle_is_skipped(workdir):
+	storage = load_storage()
+	storage.save_match(updated_match(storage, 0, '5-5'))
+	with open(storage.journal_name, 'ab') as file:
+		file.write(b'not json\n')
+	storage.save_match(updated_match(storage, 1, '2-0'))
+
+	replayed = load_storage()
+	assert replayed.content['data'][0]['score'] == '5-5'
+	assert replayed.content['data'][1]['score'] == '2-0'
+	assert replayed._journal_entries == 2
+
+
+def test_saving_calendar_drops_journal(workdir):
+	storage = load_storage()
+	storage.save_match(updated_match(storage, 0, '5-5'))
+	storage.content['data'][1] = updated_match(storage, 1, '2-0')
+	storage.save_calendar(storage.content, SEASON_ID)
+
+	# only what was in the saved content is left, journaled updates of the old calendar aren't replayed over it
+	assert not os.path.exists(storage.journal_name)
+	saved = load_storage()
+	assert saved.content['data'][0]['score'] != '5-5'
+	assert saved.content['data'][1]['score'] == '2-0'
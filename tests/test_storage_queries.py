@@ -0,0 +1,66 @@
+'''Database queries answered by SQLiteStorage equal those answered by in-memory indexes over JSONStorage'''
+
+import datetime
+import pytest
+from conftest import SEASON_ID
+from database import Database
+from storage import JSONStorage, SQLiteStorage
+
+
+@pytest.fixture
+def databases(workdir):
+	'''Database over JSONStorage and one over SQLiteStorage with the same calendar imported'''
+	json_db = Database(storage=JSONStorage())
+	json_db.read_calendar(SEASON_ID)
+	sqlite_storage = SQLiteStorage(str(workdir / 'test.sqlite3'))
+	sqlite_storage.save_calendar(JSONStorage().load_calendar(SEASON_ID), SEASON_ID)
+	sqlite_db = Database(storage=sqlite_storage)
+	sqlite_db.read_calendar(SEASON_ID)
+	return json_db, sqlite_db
+
+
+def read_dates(db: Database) -> list:
+	kickoffs = sorted({db.read_match_kickoff(m['id']) for m in db.matches})
+	dates = sorted({k.date() for k in kickoffs})
+	return dates + [dates[0] - datetime.timedelta(days=1), dates[-1] + datetime.timedelta(days=1)]
+
+
+def read_team_ids(db: Database) -> list:
+	return sorted({m['idHome'] for m in db.matches} | {m['idAway'] for m in db.matches})
+
+
+def read_ids(matches: list) -> list:
+	return [m['id'] for m in matches]
+
+
+def test_matches_by_date_are_equal(databases):
+	json_db, sqlite_db = databases
+	for date in read_dates(json_db):
+		assert read_ids(sqlite_db.read_matches_by_date(date)) == read_ids(json_db.read_matches_by_date(date)), date
+		assert sqlite_db.read_matches_by_date(date) == json_db.read_matches_by_date(date), date
+
+
+@pytest.mark.parametrize('venue', [None, 'home', 'away'])
+def test_team_last_matches_are_equal(databases, venue):
+	json_db, sqlite_db = databases
+	kickoffs = sorted({json_db.read_match_kickoff(m['id']) for m in json_db.matches})
+	moments = [None, kickoffs[0], kickoffs[len(kickoffs) // 2], kickoffs[-1] + datetime.timedelta(days=1)]
+	for team_id in read_team_ids(json_db):
+		for before in moments:
+			for n in (1, 5, 40):
+				expected = json_db.read_team_last_matches(team_id, n, before, venue)
+				assert sqlite_db.read_team_last_matches(team_id, n, before, venue) == expected, (team_id, before, n)
+
+
+def test_queries_follow_match_updates(databases):
+	json_db, sqlite_db = databases
+	match_data = dict(next(m for m in json_db.matches if m['status'] == 'not started'))
+	match_data.update(status='finished', score='3-1')
+	for db in (json_db, sqlite_db):
+		db.update_matches_data([dict(match_data)])
+
+	date = json_db.read_match_kickoff(match_data['id']).date()
+	assert sqlite_db.read_matches_by_date(date) == json_db.read_matches_by_date(date)
+	team_id = match_data['idHome']
+	assert read_ids(sqlite_db.read_team_last_matches(team_id, 3)) == read_ids(json_db.read_team_last_matches(team_id, 3))
+	assert match_data['id'] in read_ids(sqlite_db.read_team_last_matches(team_id, 40))
@@ -1,4 +1,32 @@
 import os
+import asyncio
+import tempfile
+import datetime
+import time
+from config import PREFERRED_TIME_FORMAT
+
+API_TIMEZONE = datetime.timezone.utc # timezone of match dates given by stat API
+
+
+class Clock:
+	'''Wall clock. Everything asking what time it is or waiting for a moment goes through util.clock so that
+	a replay can swap it for a faster one'''
+
+	def now(self):
+		'''Returns current timezone aware datetime object in API_TIMEZONE'''
+		return datetime.datetime.now(API_TIMEZONE)
+
+	def seconds_till(self, date_time_obj):
+		'''Returns real seconds left till a timezone aware moment'''
+		return (date_time_obj - self.now()).total_seconds()
+
+
+clock = Clock()
+
+def set_clock(new_clock):
+	'''Makes util use given clock instead of the wall clock'''
+	global clock
+	clock = new_clock
 
 def insure_dir_exists(dir):
 	if not os.path.exists(dir):
@@ -12,4 +40,67 @@ def insure_file_exists(dir, file):
 
 		# date_time_str = self.matches[-1]['date']
 		# date_time_obj = datetime.datetime.strptime(date_time_str, PREFERRED_TIME_FORMAT)
-		# return date_time_obj
\ No newline at end of file
+		# return date_time_obj
+
+def write_file_atomically(path, text):
+	'''Writes text into a temp file next to path and renames it over path so that readers never see a half-written file'''
+	dir = os.path.dirname(path) or '.'
+	fd, temp_path = tempfile.mkstemp(dir=dir, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'w', encoding='utf-8') as file:
+			file.write(text)
+			file.flush()
+			os.fsync(file.fileno())
+		os.replace(temp_path, path)
+	except BaseException:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+		raise
+
+def parse_match_date(date_str):
+	'''Returns a timezone aware datetime object parsed from a match date.
+	Calendars hold dates both as they come from the API and as reformatted by StatAPIHandler.format_time'''
+	if date_str[4:5] == '-': # API format, e.g. 2021-07-23 17:00:00
+		date_time_obj = datetime.datetime.fromisoformat(date_str)
+	else:
+		date_time_obj = datetime.datetime.strptime(date_str, PREFERRED_TIME_FORMAT)
+	return date_time_obj.replace(tzinfo=API_TIMEZONE)
+
+def match_timestamp(date_str):
+	'''Returns epoch seconds of a match date'''
+	return int(parse_match_date(date_str).timestamp())
+
+def kickoff_from_timestamp(timestamp):
+	'''Returns a timezone aware datetime object of a match kickoff by its epoch seconds'''
+	return datetime.datetime.fromtimestamp(timestamp, API_TIMEZONE)
+
+def now():
+	'''Returns current timezone aware datetime object in API_TIMEZONE'''
+	return clock.now()
+
+def next_time_of_day(time_obj):
+	'''Returns the nearest future datetime object at given time of day. Naive time is treated as local time.
+	Datetime objects are accepted as well, only their time is taken'''
+	if isinstance(time_obj, datetime.datetime):
+		time_obj = time_obj.timetz()
+	now_obj = now().astimezone(time_obj.tzinfo) if time_obj.tzinfo else now().astimezone().replace(tzinfo=None)
+	moment = datetime.datetime.combine(now_obj.date(), time_obj)
+	if moment <= now_obj:
+		moment += datetime.timedelta(days=1)
+	return moment
+
+def wait_until(date_time_obj):
+	'''Sleeps till given moment. Naive datetime objects are treated as local time'''
+	if date_time_obj.tzinfo is None:
+		date_time_obj = date_time_obj.astimezone()
+	seconds_left = clock.seconds_till(date_time_obj)
+	if seconds_left > 0:
+		time.sleep(seconds_left)
+
+async def sleep_until(date_time_obj):
+	'''Coroutine counterpart of wait_until'''
+	if date_time_obj.tzinfo is None:
+		date_time_obj = date_time_obj.astimezone()
+	seconds_left = clock.seconds_till(date_time_obj)
+	if seconds_left > 0:
+		await asyncio.sleep(seconds_left)
@@ -0,0 +1,112 @@
+'''This module receives Telegram updates through a webhook instead of long polling.
+A small HTTP server checks that an update came from Telegram and puts it into a queue read by a pool of workers.
+Can be tried locally by POSTing recorded update json to http://localhost:WEBHOOK_PORT/<webhook secret>.'''
+
+import os
+import logging
+import json
+import queue
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import telebot
+import util
+
+util.insure_dir_exists('Logs')
+log_file = os.path.join('Logs', f'{os.path.basename(__file__)}.log')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+log_formatter = logging.Formatter(fmt='%(levelname)s: %(asctime)s: %(funcName)s: %(message)s',
+								  datefmt='%d.%m.%Y %H:%M:%S %p'
+								  )
+log_file_handler = logging.FileHandler(log_file)
+logger.addHandler(log_file_handler)
+log_file_handler.setFormatter(log_formatter)
+
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = int(os.environ.get('PORT', 8443)) # hosting usually tells which port to listen to with PORT
+WEBHOOK_WORKERS = 4 # threads handling received updates
+WEBHOOK_QUEUE_SIZE = 1000 # updates waiting to be handled before Telegram is asked to resend them later
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+	'''Receives updates of a bot at a secret path and hands them over to WEBHOOK_WORKERS threads'''
+
+	def __init__(self, bot: telebot.TeleBot, url: str, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+				 workers: int = WEBHOOK_WORKERS):
+		self.bot = bot
+		self.url = url.rstrip('/')
+		# secret is derived from bot token so that it survives restarts but can't be guessed without the token
+		self.secret = hashlib.sha256(bot.token.encode()).hexdigest()[:32]
+		self.updates = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+		self.workers = [threading.Thread(target=self._handle_updates, name=f'webhook worker {i}', daemon=True)
+						for i in range(workers)]
+		self.server = ThreadingHTTPServer((host, port), self._make_request_handler())
+		self._serving = False # server.shutdown() would wait forever for a serve_forever() that was never called
+
+	def _make_request_handler(self):
+		webhook_server = self
+
+		class RequestHandler(BaseHTTPRequestHandler):
+			def do_POST(self):
+				if not webhook_server.is_authorized(self.path, self.headers.get(SECRET_TOKEN_HEADER)):
+					logger.error(f'Rejected update posted to {self.path} from {self.client_address[0]}')
+					self.send_response(403)
+					self.end_headers()
+					return
+
+				body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+				try:
+					webhook_server.updates.put_nowait(body)
+				except queue.Full:
+					# Telegram resends updates it didn't get 200 for
+					logger.error('Updates queue is full')
+					self.send_response(503)
+					self.end_headers()
+					return
+
+				self.send_response(200)
+				self.end_headers()
+
+			def log_message(self, format, *args):
+				logger.debug(format % args)
+
+		return RequestHandler
+
+	def is_authorized(self, path: str, secret_token: str = None) -> bool:
+		'''Tells if a request was made by Telegram: the secret is either in the path or in secret token header'''
+		return path.rstrip('/') == f'/{self.secret}' or secret_token == self.secret
+
+	def _handle_updates(self):
+		while True:
+			body = self.updates.get()
+			try:
+				update = telebot.types.Update.de_json(json.loads(body))
+				self.bot.process_new_updates([update])
+			except Exception:
+				logger.exception(f'Failed to handle update {body[:200]}')
+			finally:
+				self.updates.task_done()
+
+	def start(self, register: bool = True):
+		'''Starts workers and tells Telegram where to send updates unless register is False.
+		Raises telebot.apihelper.ApiException if Telegram refused the webhook'''
+		for w in self.workers:
+			w.start()
+		if register:
+			self.bot.remove_webhook()
+			self.bot.set_webhook(url=f'{self.url}/{self.secret}')
+			logger.info(f'Webhook set to {self.url}')
+
+	def serve_forever(self):
+		'''Handles requests till shutdown() is called'''
+		logger.info(f'Listening for updates at {self.server.server_address}')
+		self._serving = True
+		self.server.serve_forever()
+
+	def shutdown(self):
+		'''Stops serve_forever() if it was called and closes the listening socket'''
+		if self._serving:
+			self.server.shutdown()
+		self.server.server_close()